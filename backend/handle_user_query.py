@@ -1,9 +1,46 @@
+from concurrent.futures import TimeoutError
+import os
+
 from flask import Flask, request, jsonify
 
-from .preprocessing import TigMorphPreprocess
+from .search_engine import RANKING_MODES, SearchEngine
+from .limits import Overloaded
 
 app = Flask(__name__)
 
+# bounds the memory of one /search/batch request
+MAX_BATCH_QUERIES = 1000
+
+# Admission control and deadlines of the searches (a limits.SearchLimiter),
+# set in every worker by serve.py; the development server runs them inline
+limiter = None
+
+# Everything the queries need is loaded once, when the process starts
+engine = SearchEngine(os.environ.get("TIG_INDEX_DIR", "tig_index"))
+print(
+    f"Search engine loaded {engine.index.num_documents} documents "
+    f"({engine.index.num_docs} pages) in "
+    f"{engine.load_seconds:.2f}s (peak RSS {engine.peak_rss_mb:.1f} MB)"
+)
+
+
+def run_search(search, *args, **kwargs):
+    if limiter is None:
+        return search(*args, **kwargs)
+    return limiter.run(search, *args, **kwargs)
+
+
+@app.errorhandler(Overloaded)
+def overloaded(error):
+    response = jsonify({"error": "Too many searches in progress, try again"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+@app.errorhandler(TimeoutError)
+def timed_out(error):
+    return jsonify({"error": "The search took too long"}), 504
+
 
 @app.route("/search", methods=["POST"])
 def search_query():
@@ -12,28 +49,53 @@ def search_query():
 
     if not query:
         return jsonify({"error": "No query provided"}), 400
+    if not isinstance(query, str):
+        return jsonify({"error": "query must be a string"}), 400
 
-    # Instantiate and preprocess the query
-    # psr = TigMorphPreprocess([query])
-    # tokens = psr.tokenize().normalize().remove_stopwords().stem().get_result()
+    ranking = data.get("ranking", "cosine")
+    if ranking not in RANKING_MODES:
+        return jsonify({"error": f"ranking must be one of {list(RANKING_MODES)}"}), 400
 
-    # use the tokens to retrieve documents and return them ranked in the following way
+    # ranked in the following way
     # [
     #     {
-    #         "document_title:" "1st_document_title",
-    #         "document_location:" "1st_document_location",
-    #     },
-    #     {
-    #         "document_title": "2nd_document_title",
-    #         "document_location": "2nd_document_location",
-    #     },
-    #     {
-    #         "document_title": "3rd_document_title",
-    #         "document_location": "3rd_document_location",
+    #         "document_title": "1st_document_title",
+    #         "document_location": "1st_document_location#page=N",
+    #         "page": N,
     #     },
+    #     ...
     # ]
+    return jsonify(run_search(engine.search, query, ranking=ranking))
+
+
+@app.route("/search/batch", methods=["POST"])
+def search_batch():
+    data = request.json
+    queries = data.get("queries")
+
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"error": "No queries provided"}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return (
+            jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries per batch"}),
+            400,
+        )
+    if not all(isinstance(query, str) for query in queries):
+        return jsonify({"error": "queries must be strings"}), 400
+
+    ranking = data.get("ranking", "cosine")
+    if ranking not in RANKING_MODES:
+        return jsonify({"error": f"ranking must be one of {list(RANKING_MODES)}"}), 400
+
+    # one ranked list per query, in the order of the queries, each like the
+    # result of /search
+    return jsonify(run_search(engine.search_batch, queries, ranking=ranking))
+
 
-    return jsonify({"it": "works!"})
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    # hits, misses, hit rate, evictions and expirations of the result cache
+    return jsonify(engine.cache.stats())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,757 @@
+from bisect import bisect_left
+from itertools import chain
+import json
+import os
+
+import numpy as np
+
+from .scoring import log_idf, tf_idf_weights
+
+
+FORMAT_NAME = "tig-inverted-index"
+FORMAT_VERSION = 5
+
+META_FILE = "meta.json"
+TERMS_FILE = "terms.txt"
+DOCUMENTS_FILE = "documents.json"
+LEXICON_FILE = "lexicon.npy"
+SKIPS_FILE = "skips.npy"
+POSTINGS_FILE = "postings.bin"
+
+# per-document and per-term statistics used for ranking, stored as <name>.npy
+STATISTICS = (
+    "doc_lengths",  # number of tokens of each document
+    "doc_norms",  # euclidean norm of each document's tf-idf vector
+    "idf",  # scoring.log_idf of each term
+    "max_weights",  # largest tf-idf / doc norm of each term, a WAND upper bound
+    "max_tfs",  # largest count of each term in a document
+    "min_lengths",  # length of the shortest document containing each term
+)
+
+# postings per compressed block, each block is reachable through a skip pointer
+BLOCK_SIZE = 128
+# largest varint we ever write is a uint32 (5 bytes of 7 bits)
+MAX_VARINT_BYTES = 5
+# doc id of an exhausted cursor, compares greater than every real document
+END_OF_POSTINGS = np.iinfo(np.int64).max
+# values encoded by one encode_varints call, which needs ~60 bytes per value
+ENCODE_CHUNK = 1 << 20
+
+
+def encode_varints(values):
+    """
+    Variable-byte encoding of non-negative integers: 7 bits per byte,
+    least significant group first, high bit set on every byte but the last.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    groups = np.stack(
+        [
+            (values >> np.uint64(7 * i)) & np.uint64(0x7F)
+            for i in range(MAX_VARINT_BYTES)
+        ],
+        axis=1,
+    ).astype(np.uint8)
+
+    num_bytes = varint_lengths(values)
+    used = np.arange(MAX_VARINT_BYTES) < num_bytes[:, None]
+    continued = np.arange(MAX_VARINT_BYTES) < (num_bytes - 1)[:, None]
+    groups[continued] |= 0x80
+    return groups[used].tobytes()
+
+
+def varint_lengths(values):
+    """Number of 7-bit groups needed by each value (at least one, for zero)."""
+    values = np.asarray(values, dtype=np.uint64)
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for i in range(1, MAX_VARINT_BYTES):
+        num_bytes += values >= np.uint64(1 << (7 * i))
+    return num_bytes
+
+
+def decode_varints(data):
+    """Inverse of encode_varints, returns an int64 array."""
+    data = np.frombuffer(data, dtype=np.uint8)
+    if not len(data):
+        return np.empty(0, dtype=np.int64)
+
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    payload = (data & 0x7F).astype(np.int64) << shifts
+    return np.add.reduceat(payload, starts)
+
+
+def posting_arrays(postings, with_positions):
+    """
+    postings: [(document ordinal, [positions])]
+
+    Returns (document ordinals, term frequencies, position gaps) of the
+    postings, the position gaps of all of them one after the other (None
+    without positions).
+    """
+    doc_ids = np.fromiter((doc_id for doc_id, _ in postings), dtype=np.int64)
+    tfs = np.fromiter((len(positions) for _, positions in postings), dtype=np.int64)
+    if not with_positions:
+        return doc_ids, tfs, None
+
+    positions = np.fromiter(
+        chain.from_iterable(positions for _, positions in postings),
+        dtype=np.int64,
+        count=int(tfs.sum()),
+    )
+    position_gaps = np.diff(positions, prepend=0)
+    # every document's positions start over from zero
+    starts = (np.cumsum(tfs) - tfs)[tfs > 0]
+    position_gaps[starts] = positions[starts]
+    return doc_ids, tfs, position_gaps
+
+
+def list_blocks(df):
+    """
+    (list, index in the list, number of postings) of every block of the
+    posting lists with df postings each.
+    """
+    blocks_per_list = -(-df // BLOCK_SIZE)
+    block_lists = np.repeat(np.arange(len(df)), blocks_per_list)
+    block_index = np.arange(len(block_lists)) - np.repeat(
+        np.cumsum(blocks_per_list) - blocks_per_list, blocks_per_list
+    )
+    block_sizes = np.minimum(BLOCK_SIZE, df[block_lists] - block_index * BLOCK_SIZE)
+    return block_lists, block_index, block_sizes
+
+
+def encode_posting_lists(df, doc_ids, tfs, position_gaps=None, bases=None):
+    """
+    Encodes posting lists that follow each other, given as the number of
+    postings of every list (df, at least one) and the posting_arrays of all
+    their postings, list after list, sorted by document ordinal in a list.
+
+    A list is cut into blocks of BLOCK_SIZE postings. Each block is one run
+    of varints laid out as
+    [document gaps] [term frequencies] [position gaps of each document]
+    where document gaps continue from the last document of the previous block
+    (from the list's entry of bases, zero by default, for the first block) and
+    positions restart from zero for every document.
+
+    Returns (encoded bytes, skip pointers, byte offsets of the lists plus the
+    end) with one skip pointer per block: (last document ordinal of the
+    block, end offset of the block in bytes from the start of its list).
+    """
+    if not len(df):
+        return b"", np.empty((0, 2), dtype=np.int64), np.zeros(1, dtype=np.int64)
+
+    list_starts = np.cumsum(df) - df
+    block_lists, block_index, block_sizes = list_blocks(df)
+    block_starts = list_starts[block_lists] + block_index * BLOCK_SIZE
+    posting_blocks = np.repeat(np.arange(len(block_sizes)), block_sizes)
+
+    # document gaps run on from block to block and start over with every list
+    gaps = np.diff(doc_ids, prepend=0)
+    gaps[list_starts] = doc_ids[list_starts] - (0 if bases is None else bases)
+
+    # index of every value in the file, block after block
+    if position_gaps is None:
+        num_positions = 0
+    else:
+        num_positions = np.add.reduceat(tfs, block_starts)
+    block_lengths = 2 * block_sizes + num_positions
+    block_values = np.cumsum(block_lengths) - block_lengths
+    values = np.empty(int(block_lengths.sum()), dtype=np.int64)
+    indices = (block_values - block_starts)[posting_blocks] + np.arange(len(doc_ids))
+    values[indices] = gaps
+    values[indices + block_sizes[posting_blocks]] = tfs
+    if position_gaps is not None:
+        position_starts = np.cumsum(tfs) - tfs
+        shifts = block_values + 2 * block_sizes - position_starts[block_starts]
+        positions = np.repeat(shifts[posting_blocks], tfs)
+        values[positions + np.arange(len(position_gaps))] = position_gaps
+
+    block_ends = np.cumsum(varint_lengths(values))[block_values + block_lengths - 1]
+    last_blocks = np.cumsum(-(-df // BLOCK_SIZE)) - 1
+    list_offsets = np.concatenate(([0], block_ends[last_blocks]))
+    skips = np.column_stack(
+        (
+            doc_ids[block_starts + block_sizes - 1],
+            block_ends - list_offsets[block_lists],
+        )
+    )
+    encoded = b"".join(
+        encode_varints(values[start : start + ENCODE_CHUNK])
+        for start in range(0, len(values), ENCODE_CHUNK)
+    )
+    return encoded, skips, list_offsets
+
+
+def decode_varints_at(data, ends, indices):
+    """
+    The varints of data with the given indices, ends being the offsets of
+    the last byte of every varint (np.flatnonzero(data < 0x80)).
+    """
+    starts = np.where(indices > 0, ends[indices - 1] + 1, 0)
+    lengths = ends[indices] - starts + 1
+    values = np.zeros(len(indices), dtype=np.int64)
+    for i in range(MAX_VARINT_BYTES):
+        more = lengths > i
+        values[more] |= (data[starts[more] + i] & 0x7F).astype(np.int64) << (7 * i)
+    return values
+
+
+def decode_posting_blocks(data, ends, block_starts, block_sizes, with_positions):
+    """
+    Inverse of encode_posting_lists for the blocks of data starting at the
+    byte offsets block_starts, with block_sizes postings each; ends as in
+    decode_varints_at. Returns the (document gaps, term frequencies,
+    position gaps) of all their postings, decoded together without a Python
+    loop. The position gaps are only decoded with_positions.
+    """
+    if not len(block_sizes):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty if with_positions else None
+
+    # a block starts with the gaps of its n postings, then their frequencies
+    posting_starts = np.cumsum(block_sizes) - block_sizes
+    first_values = np.searchsorted(ends, block_starts)
+    gap_indices = np.repeat(first_values - posting_starts, block_sizes) + np.arange(
+        block_sizes.sum()
+    )
+    gaps = decode_varints_at(data, ends, gap_indices)
+    tfs = decode_varints_at(
+        data, ends, gap_indices + np.repeat(block_sizes, block_sizes)
+    )
+    if not with_positions:
+        return gaps, tfs, None
+
+    num_positions = np.add.reduceat(tfs, posting_starts)
+    position_indices = np.repeat(
+        first_values + 2 * block_sizes - (np.cumsum(num_positions) - num_positions),
+        num_positions,
+    ) + np.arange(num_positions.sum())
+    return gaps, tfs, decode_varints_at(data, ends, position_indices)
+
+
+def decode_postings_file(data, lexicon, skips):
+    """
+    (term ids, document ordinals, term frequencies) of every posting of the
+    postings file data, in file order. The positions are not decoded.
+    """
+    num_terms = len(lexicon) - 1
+    df = lexicon[:-1, 1]
+
+    # the blocks of all the terms follow each other in the file
+    block_terms, _, block_sizes = list_blocks(df)
+    block_ends = lexicon[block_terms, 0] + skips[:, 1]
+    block_starts = np.concatenate(([0], block_ends))[:-1]
+    gaps, tfs, _ = decode_posting_blocks(
+        data, np.flatnonzero(data < 0x80), block_starts, block_sizes, False
+    )
+    return np.repeat(np.arange(num_terms), df), restore_doc_ids(gaps, df), tfs
+
+
+def restore_doc_ids(gaps, df, bases=None):
+    """
+    Document ordinals of the postings of lists of df postings each from
+    their gaps, which start from the lists' bases (zero by default).
+    """
+    doc_ids = np.cumsum(gaps)
+    nonempty = df > 0
+    list_starts = (np.cumsum(df) - df)[nonempty]
+    shifts = doc_ids[list_starts] - gaps[list_starts]
+    if bases is not None:
+        shifts -= bases[nonempty]
+    doc_ids -= np.repeat(shifts, df[nonempty])
+    return doc_ids
+
+
+def compute_statistics(term_ids, doc_ids, counts, num_terms, documents):
+    """
+    Ranking statistics of the collection from the term, document and count
+    of every posting, with the tf-idf weights of the sparse index (see
+    scoring.tf_idf_weights).
+    """
+    N = len(documents)
+    doc_lengths = np.array(
+        [document["length"] for document in documents], dtype=np.int64
+    )
+    df = np.bincount(term_ids, minlength=num_terms)
+    idf = log_idf(N, df)
+    weights = tf_idf_weights(counts, doc_lengths[doc_ids], idf[term_ids])
+
+    doc_norms = np.sqrt(np.bincount(doc_ids, weights=weights**2, minlength=N))
+    normalized = np.divide(
+        weights,
+        doc_norms[doc_ids],
+        out=np.zeros_like(weights),
+        where=doc_norms[doc_ids] > 0,
+    )
+    max_weights = np.zeros(num_terms)
+    np.maximum.at(max_weights, term_ids, normalized)
+
+    # BM25 grows with tf and shrinks with document length, so together these
+    # bound a term's BM25 weight whatever k1 and b are used at query time
+    max_tfs = np.zeros(num_terms, dtype=np.int64)
+    np.maximum.at(max_tfs, term_ids, counts)
+    min_lengths = np.full(num_terms, np.iinfo(np.int64).max)
+    np.minimum.at(min_lengths, term_ids, doc_lengths[doc_ids])
+
+    return {
+        "doc_lengths": doc_lengths,
+        "doc_norms": doc_norms,
+        "idf": idf,
+        "max_weights": max_weights,
+        "max_tfs": max_tfs,
+        "min_lengths": min_lengths,
+    }
+
+
+def save_inverted_index(postings, documents, output_dir, with_positions=True):
+    """
+    postings: {term: [(document ordinal, [positions])]}
+    documents: [{"document_id", "page", "document_location", "length"}] of
+    every page, in ordinal order
+
+    Layout of output_dir:
+    - meta.json       format name/version and counts
+    - terms.txt       vocabulary, one term per line (sorted)
+    - documents.json  page table
+    - lexicon.npy     (byte offset, document frequency, first skip pointer)
+                      of every term
+    - skips.npy       (last document ordinal, block end offset) of every block
+    - postings.bin    compressed posting lists, see encode_posting_lists
+    - *.npy           ranking statistics, see STATISTICS
+    """
+    terms = sorted(postings.keys())
+    df = np.array([len(postings[term]) for term in terms], dtype=np.int64)
+    doc_ids, tfs, position_gaps = posting_arrays(
+        list(chain.from_iterable(postings[term] for term in terms)), with_positions
+    )
+    encoded, skips, offsets = encode_posting_lists(df, doc_ids, tfs, position_gaps)
+    statistics = compute_statistics(
+        np.repeat(np.arange(len(terms)), df), doc_ids, tfs, len(terms), documents
+    )
+
+    encoded = memoryview(encoded)
+    skip_offsets = np.concatenate(([0], np.cumsum(-(-df // BLOCK_SIZE))))
+    posting_lists = (
+        (
+            term,
+            encoded[offsets[term_id] : offsets[term_id + 1]],
+            skips[skip_offsets[term_id] : skip_offsets[term_id + 1]],
+            df[term_id],
+        )
+        for term_id, term in enumerate(terms)
+    )
+    _save_index(posting_lists, documents, output_dir, with_positions, statistics)
+
+
+def merge_inverted_index(index, removed, postings, documents, output_dir):
+    """
+    Writes to output_dir the index of index without the pages of the
+    ordinals removed, and with postings ({term: [(document ordinal,
+    [positions])]}) of the pages appended after the others. documents is
+    the page table of the result.
+
+    Removing pages renumbers the pages after them, and appending postings
+    changes the last block of a list, so a posting list is copied as it is
+    encoded up to its first block that holds one of those pages or is not
+    full. Only the rest of the lists an update touches is decoded, and
+    encoded again with the new postings, all of them together: a day's new
+    issue costs its own postings and one block per term it contains, not a
+    rebuild.
+    """
+    with_positions = index.meta["with_positions"]
+    removed = np.array(sorted(removed), dtype=np.int64)
+    first_removed = int(removed[0]) if len(removed) else END_OF_POSTINGS
+
+    # plain arrays, slicing a memmap costs more than copying a posting list
+    data = np.asarray(index._postings)
+    lexicon = np.asarray(index.lexicon)
+    all_skips = np.asarray(index.skips)
+    df = lexicon[:-1, 1]
+    block_terms, block_index, block_sizes = list_blocks(df)
+
+    # a term keeps its blocks before the first one with a removed page, but
+    # not its last block if that is not full and the term has new postings
+    keep = np.bincount(
+        block_terms[all_skips[:, 0] < first_removed], minlength=index.num_terms
+    )
+    appended = np.zeros(index.num_terms, dtype=bool)
+    appended[[index.term_ids[term] for term in postings if term in index.term_ids]] = 1
+    keep[appended & (keep * BLOCK_SIZE > df)] -= 1
+    touched = appended | (keep * BLOCK_SIZE < df)
+    tail_df = np.where(touched, df - keep * BLOCK_SIZE, 0)
+    bases = np.zeros(index.num_terms, dtype=np.int64)
+    bases[keep > 0] = all_skips[(lexicon[:-1, 2] + keep - 1)[keep > 0], 0]
+
+    # postings of the rest of the touched terms, without the removed pages
+    # and with the pages after them moved up
+    tail_blocks = touched[block_terms] & (block_index >= keep[block_terms])
+    block_ends = lexicon[block_terms, 0] + all_skips[:, 1]
+    block_starts = np.concatenate(([0], block_ends))[:-1]
+    gaps, tfs, position_gaps = decode_posting_blocks(
+        data,
+        np.flatnonzero(data < 0x80),
+        block_starts[tail_blocks],
+        block_sizes[tail_blocks],
+        with_positions,
+    )
+    doc_ids = restore_doc_ids(gaps, tail_df, bases)
+    alive = ~np.isin(doc_ids, removed)
+    doc_ids = doc_ids[alive] - np.searchsorted(removed, doc_ids[alive])
+    if with_positions:
+        position_gaps = position_gaps[np.repeat(alive, tfs)]
+    tfs = tfs[alive]
+
+    # the new postings go after the old ones of their term
+    terms = sorted(set(index.terms).union(postings))
+    term_ids = {term: term_id for term_id, term in enumerate(terms)}
+    old_ids = np.array([term_ids[term] for term in index.terms], dtype=np.int64)
+    new_terms = sorted(postings)
+    new_df = np.array([len(postings[term]) for term in new_terms], dtype=np.int64)
+    new_doc_ids, new_tfs, new_position_gaps = posting_arrays(
+        list(chain.from_iterable(postings[term] for term in new_terms)), with_positions
+    )
+    list_ids = np.concatenate(
+        (
+            np.repeat(old_ids, tail_df)[alive],
+            np.repeat([term_ids[term] for term in new_terms], new_df).astype(np.int64),
+        )
+    )
+    order = np.argsort(list_ids, kind="stable")
+    doc_ids = np.concatenate((doc_ids, new_doc_ids))[order]
+    tfs = np.concatenate((tfs, new_tfs))
+    if with_positions:
+        position_gaps = np.concatenate((position_gaps, new_position_gaps))
+        position_starts = (np.cumsum(tfs) - tfs)[order]
+        tfs = tfs[order]
+        position_gaps = position_gaps[
+            np.repeat(position_starts - (np.cumsum(tfs) - tfs), tfs)
+            + np.arange(len(position_gaps))
+        ]
+    else:
+        tfs = tfs[order]
+
+    lists, merged_df = np.unique(list_ids, return_counts=True)
+    term_bases = np.zeros(len(terms), dtype=np.int64)
+    term_bases[old_ids] = bases
+    encoded, skips, offsets = encode_posting_lists(
+        merged_df, doc_ids, tfs, position_gaps, term_bases[lists]
+    )
+    skip_offsets = np.concatenate(([0], np.cumsum(-(-merged_df // BLOCK_SIZE))))
+    merged = dict(zip(lists.tolist(), range(len(lists))))
+
+    def posting_lists():
+        rows = lexicon.tolist()
+        for term_id, term in enumerate(terms):
+            old_id = index.term_ids.get(term)
+            kept = start = first_skip = 0
+            if old_id is not None:
+                start, old_df, first_skip = rows[old_id]
+                end, _, last_skip = rows[old_id + 1]
+                if not touched[old_id]:
+                    yield term, data[start:end], all_skips[first_skip:last_skip], old_df
+                    continue
+                kept = int(keep[old_id])
+
+            kept_bytes = int(all_skips[first_skip + kept - 1, 1]) if kept else 0
+            kept_data = data[start : start + kept_bytes]
+            kept_skips = all_skips[first_skip : first_skip + kept]
+            i = merged.get(term_id)
+            if i is None:
+                # every page of the tail was removed
+                if kept:
+                    yield term, kept_data, kept_skips, kept * BLOCK_SIZE
+                continue
+
+            tail_skips = skips[skip_offsets[i] : skip_offsets[i + 1]].copy()
+            tail_skips[:, 1] += kept_bytes
+            yield (
+                term,
+                kept_data.tobytes() + encoded[offsets[i] : offsets[i + 1]],
+                np.concatenate((kept_skips, tail_skips)),
+                kept * BLOCK_SIZE + int(merged_df[i]),
+            )
+
+    _save_index(posting_lists(), documents, output_dir, with_positions)
+
+
+def _save_index(posting_lists, documents, output_dir, with_positions, statistics=None):
+    """
+    Writes the index of posting_lists, (term, encoded bytes, skip pointers,
+    document frequency) of every term in sorted order, and documents.
+    The ranking statistics are computed from the postings file once it is
+    written, unless they are given.
+
+    Every file is written next to the one it replaces and renamed over it,
+    meta.json last, so processes that have the old index memory-mapped keep
+    a valid view and a half-written index is never opened.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    temp_paths = []
+
+    def create(file_name, mode="wb"):
+        path = os.path.join(output_dir, file_name + ".tmp")
+        temp_paths.append(path)
+        return open(path, mode, encoding=None if "b" in mode else "utf-8")
+
+    terms, lexicon, skips = [], [], []
+    offset = num_skips = 0
+    with create(POSTINGS_FILE) as file:
+        for term, encoded, term_skips, df in posting_lists:
+            file.write(encoded)
+            terms.append(term)
+            lexicon.append((offset, df, num_skips))
+            term_skips = np.asarray(term_skips, dtype=np.int64).reshape(-1, 2)
+            skips.append(term_skips)
+            num_skips += len(term_skips)
+            offset += len(encoded)
+    # sentinel row so every term's end offsets are the next row's offsets
+    lexicon.append((offset, 0, num_skips))
+    lexicon = np.array(lexicon, dtype=np.int64)
+    skips = np.concatenate(skips) if skips else np.empty((0, 2), dtype=np.int64)
+
+    with create(LEXICON_FILE) as file:
+        np.save(file, lexicon)
+    with create(SKIPS_FILE) as file:
+        np.save(file, skips)
+
+    if statistics is None:
+        data = np.fromfile(temp_paths[0], dtype=np.uint8)
+        arrays = decode_postings_file(data, lexicon, skips)
+        statistics = compute_statistics(*arrays, len(terms), documents)
+        del data
+    for name in STATISTICS:
+        with create(f"{name}.npy") as file:
+            np.save(file, statistics[name])
+
+    with create(TERMS_FILE, "w") as file:
+        file.write("\n".join(terms))
+
+    with create(DOCUMENTS_FILE, "w") as file:
+        json.dump(documents, file, ensure_ascii=False)
+
+    meta = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "num_terms": len(terms),
+        "num_docs": len(documents),
+        "with_positions": with_positions,
+        "block_size": BLOCK_SIZE,
+        "postings_bytes": offset,
+    }
+    with create(META_FILE, "w") as file:
+        json.dump(meta, file, indent=4)
+
+    for temp_path in temp_paths:
+        os.replace(temp_path, temp_path[: -len(".tmp")])
+
+
+class PostingCursor:
+    """
+    Forward iterator over the posting list of one term.
+    Blocks are decoded on demand; next_geq uses the skip pointers to jump over
+    blocks that cannot contain the target without decoding them.
+    """
+
+    def __init__(self, data, df, skips, with_positions):
+        self.df = df
+        self._data = data
+        self._skips = skips
+        self._with_positions = with_positions
+        self._block = -1
+        self._load_block(0)
+
+    def _load_block(self, block):
+        self._block = block
+        if block >= len(self._skips):
+            self.doc = END_OF_POSTINGS
+            return
+
+        start = self._skips[block - 1, 1] if block else 0
+        values = decode_varints(self._data[start : self._skips[block, 1]])
+
+        n = min(BLOCK_SIZE, self.df - block * BLOCK_SIZE)
+        base = self._skips[block - 1, 0] if block else 0
+        self._doc_ids = (base + np.cumsum(values[:n])).tolist()
+        self._tfs = values[n : 2 * n].tolist()
+        self._position_gaps = values[2 * n :]
+        self._position_starts = np.concatenate(([0], np.cumsum(self._tfs)))
+        self._i = 0
+        self.doc = self._doc_ids[0]
+
+    @property
+    def tf(self):
+        return self._tfs[self._i]
+
+    def positions(self):
+        if not self._with_positions:
+            raise ValueError("The index was built without positions")
+        start, end = self._position_starts[self._i : self._i + 2]
+        return np.cumsum(self._position_gaps[start:end], dtype=np.int64)
+
+    def next(self):
+        """Moves to the next posting and returns its document ordinal."""
+        self._i += 1
+        if self._i < len(self._doc_ids):
+            self.doc = self._doc_ids[self._i]
+        else:
+            self._load_block(self._block + 1)
+        return self.doc
+
+    def next_geq(self, target):
+        """Moves to the first posting with document ordinal >= target."""
+        if self.doc >= target:
+            return self.doc
+
+        if target > self._skips[self._block, 0]:
+            # the target lies beyond this block, find the block that may hold it
+            block = int(
+                np.searchsorted(self._skips[self._block :, 0], target, side="left")
+            )
+            self._load_block(self._block + block)
+            if self.doc == END_OF_POSTINGS:
+                return self.doc
+
+        self._i = bisect_left(self._doc_ids, target, self._i)
+        self.doc = self._doc_ids[self._i]
+        return self.doc
+
+
+class PostingList:
+    """Fully decoded posting list of a single term."""
+
+    def __init__(self, data, df, with_positions):
+        values = decode_varints(data)
+
+        doc_gaps, tfs, position_gaps = [], [], []
+        i = 0
+        for start in range(0, df, BLOCK_SIZE):
+            n = min(BLOCK_SIZE, df - start)
+            block_tfs = values[i + n : i + 2 * n]
+            num_positions = int(block_tfs.sum()) if with_positions else 0
+            doc_gaps.append(values[i : i + n])
+            tfs.append(block_tfs)
+            position_gaps.append(values[i + 2 * n : i + 2 * n + num_positions])
+            i += 2 * n + num_positions
+
+        # document gaps continue across blocks, so one cumsum restores them all
+        self.doc_ids = np.cumsum(np.concatenate(doc_gaps), dtype=np.int64)
+        self.tfs = np.concatenate(tfs)
+        self._position_gaps = np.concatenate(position_gaps) if with_positions else None
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def positions(self):
+        """Token positions of the term in each document of the list."""
+        if self._position_gaps is None:
+            raise ValueError("The index was built without positions")
+        bounds = np.cumsum(self.tfs)[:-1]
+        return [
+            np.cumsum(gaps, dtype=np.int64)
+            for gaps in np.split(self._position_gaps, bounds)
+        ]
+
+
+class InvertedIndex:
+    """
+    Read-only view of an index written by save_inverted_index.
+    postings.bin is memory-mapped and a posting list is only read and decoded
+    when its term is requested, either whole (postings) or block by block
+    (cursor).
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+
+        with open(os.path.join(index_dir, META_FILE), "r", encoding="utf-8") as file:
+            self.meta = json.load(file)
+
+        if self.meta.get("format") != FORMAT_NAME:
+            raise ValueError(f"{index_dir} is not a {FORMAT_NAME} directory")
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported index version {self.meta.get('version')} "
+                f"(expected {FORMAT_VERSION}), rebuild the index"
+            )
+
+        with open(os.path.join(index_dir, TERMS_FILE), "r", encoding="utf-8") as file:
+            self.terms = file.read().split("\n") if self.meta["num_terms"] else []
+        self.term_ids = {term: term_id for term_id, term in enumerate(self.terms)}
+
+        with open(
+            os.path.join(index_dir, DOCUMENTS_FILE), "r", encoding="utf-8"
+        ) as file:
+            self.documents = json.load(file)
+
+        self.lexicon = np.load(os.path.join(index_dir, LEXICON_FILE), mmap_mode="r")
+        self.skips = np.load(os.path.join(index_dir, SKIPS_FILE), mmap_mode="r")
+        for name in STATISTICS:
+            array = np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+            setattr(self, name, array)
+        postings_path = os.path.join(index_dir, POSTINGS_FILE)
+        if os.path.getsize(postings_path):
+            self._postings = np.memmap(postings_path, dtype=np.uint8, mode="r")
+        else:
+            self._postings = np.empty(0, dtype=np.uint8)
+
+    @property
+    def num_terms(self):
+        return self.meta["num_terms"]
+
+    @property
+    def num_docs(self):
+        return self.meta["num_docs"]
+
+    def document_frequency(self, term):
+        term_id = self.term_ids.get(term)
+        return 0 if term_id is None else int(self.lexicon[term_id, 1])
+
+    def _term_slices(self, term):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return None
+        start, df, first_skip = self.lexicon[term_id]
+        end, _, last_skip = self.lexicon[term_id + 1]
+        return self._postings[start:end], int(df), self.skips[first_skip:last_skip]
+
+    def postings(self, term):
+        """PostingList of term, None if term is out of vocabulary."""
+        slices = self._term_slices(term)
+        if slices is None:
+            return None
+        data, df, _ = slices
+        return PostingList(data, df, self.meta["with_positions"])
+
+    def cursor(self, term):
+        """PostingCursor over term, None if term is out of vocabulary."""
+        slices = self._term_slices(term)
+        if slices is None:
+            return None
+        data, df, skips = slices
+        return PostingCursor(data, df, skips, self.meta["with_positions"])
+
+    def conjunctive_doc_ids(self, terms):
+        """
+        Document ordinals containing every one of terms.
+        The rarest term drives the intersection and the other cursors leap
+        to its candidates through their skip pointers.
+        """
+        cursors = [self.cursor(term) for term in set(terms)]
+        if not cursors or any(cursor is None for cursor in cursors):
+            return []
+        cursors.sort(key=lambda cursor: cursor.df)
+
+        matches = []
+        lead, others = cursors[0], cursors[1:]
+        doc = lead.doc
+        while doc != END_OF_POSTINGS:
+            for cursor in others:
+                found = cursor.next_geq(doc)
+                if found != doc:
+                    # skip the lead forward to the first candidate not ruled out
+                    doc = lead.next_geq(found)
+                    break
+            else:
+                matches.append(doc)
+                doc = lead.next()
+        return matches
@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import threading
+
+
+class Overloaded(Exception):
+    pass
+
+
+class SearchLimiter:
+    """
+    Admission control and deadlines for the searches of one worker process.
+
+    Connections are read and answered by the threads of the HTTP server,
+    which only wait on I/O; the searches themselves run on a pool of
+    max_active threads. Up to max_waiting more searches queue for the pool,
+    and any beyond that are turned away at once (503) instead of piling up.
+    A request that has no result after timeout seconds, queueing included,
+    is answered 504; a search still queued is then dropped, one already
+    running finishes but keeps its slot until it does, so the limit stays
+    true.
+    """
+
+    def __init__(self, max_active=4, max_waiting=64, timeout=10.0):
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_active, thread_name_prefix="search")
+        self._slots = threading.BoundedSemaphore(max_active + max_waiting)
+
+    def run(self, search, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise Overloaded()
+        try:
+            future = self._pool.submit(search, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
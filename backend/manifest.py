@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+
+
+# no extension, so that no stage ever takes it for one of its documents
+MANIFEST_FILE = ".manifest"
+
+
+def file_hash(file_path, chunk_size=2**20):
+    """sha256 of the content of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    What one stage of the build has already processed, so that a rerun only
+    redoes new or changed documents.
+
+    Stored as .manifest in the stage's output folder:
+    {source file name: {"hash", "size", "mtime_ns", ...stage outputs}}
+    Files whose size and modification time are unchanged are not hashed
+    again; the others are, so touching a file without changing it does not
+    make it stale.
+    """
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, MANIFEST_FILE)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as file:
+                self.entries = json.load(file)
+
+    def _hash(self, file_path, entry):
+        stat = os.stat(file_path)
+        if entry and (entry["size"], entry["mtime_ns"]) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+        ):
+            return entry["hash"], stat
+        return file_hash(file_path), stat
+
+    def changes(self, source_folder, file_names, output_exists=None):
+        """
+        Compares the files of source_folder with the manifest.
+        output_exists(file name, entry), if given, also marks as changed the
+        files whose recorded output is gone.
+
+        Returns (new or changed file names, removed file names, fingerprints)
+        where fingerprints holds the hash, size and mtime of every file, to
+        be recorded once the file is processed.
+        """
+        changed, fingerprints = [], {}
+        for file_name in file_names:
+            entry = self.entries.get(file_name)
+            digest, stat = self._hash(os.path.join(source_folder, file_name), entry)
+            fingerprints[file_name] = {
+                "hash": digest,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }
+            if (
+                entry is None
+                or entry["hash"] != digest
+                or (output_exists is not None and not output_exists(file_name, entry))
+            ):
+                changed.append(file_name)
+
+        removed = [name for name in self.entries if name not in fingerprints]
+        return changed, removed, fingerprints
+
+    def record(self, file_name, fingerprint, **outputs):
+        self.entries[file_name] = {**fingerprint, **outputs}
+
+    def forget(self, file_name):
+        return self.entries.pop(file_name, None)
+
+    def save(self):
+        # write then rename, so an interrupted run leaves the old manifest
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self.entries, file, ensure_ascii=False, indent=4)
+        os.replace(temp_path, self.path)
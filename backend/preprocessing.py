@@ -1,9 +1,78 @@
 from collections import Counter
+import io
+from itertools import repeat
 import numpy as np
 import re
 
 from .helper_functions import *
-from .girma_stemmer import TigrinyaStemmer
+from .resources import get_resources
+
+
+quote_vars = [
+    "\u0027",
+    "\u2018",
+    "\u2019",
+    "\u2032",
+    "\u02BC",
+    "\u0060",
+    "\u00B4",
+]
+english_punctuation = "".join(
+    [
+        "\u002E",  # Period.
+        "\u002C",  # Comma.
+        "\u0021",  # Exclamation Mark.
+        "\u003F",  # Question Mark.
+        "\u003A",  # Colon.
+        "\u003B",  # Semicolon.
+        "\u0027",  # Apostrophe.
+        "\u0022",  # Double Quotation Mark.
+        "\u201C",  # Left Double Quotation Mark.
+        "\u201D",  # Right Double Quotation Mark.
+        "\u2018",  # Left Single Quotation Mark.
+        "\u2019",  # Right Single Quotation Mark.
+        "\u2010",  # Hyphen.
+        "\u2013",  # En Dash.
+        "\u2014",  # Em Dash.
+        "\u0028",  # Left Parenthesis.
+        "\u0029",  # Right Parenthesis.
+        "\u005B",  # Left Square Bracket.
+        "\u005D",  # Right Square Bracket.
+        "\u007B",  # Left Curly Bracket.
+        "\u007D",  # Right Curly Bracket.
+        "\u2026",  # Ellipsis.
+        "\u002F",  # Slash
+        "\u005C",  # Backslash
+        "\u0026",  # Ampersand
+        "\u002A",  # Asterisk
+    ]
+)
+ethiopic_punctuation = "".join(chr(code_point) for code_point in range(0x1361, 0x1369))
+punctuation = english_punctuation + ethiopic_punctuation
+punctuation_table = str.maketrans("", "", punctuation)
+
+
+def char_class(chars):
+    return "[" + "".join(map(re.escape, chars)) + "]"
+
+
+# The alphabet and the punctuation marks are compiled into character classes
+# once. A whitespace-delimited word is kept when, punctuation aside, it is made
+# of Ethiopic letters only; the punctuation is then deleted from the kept words
+# with one str.translate.
+letter = char_class(transliteration_table)
+filter_pattern = re.compile(
+    rf"(?<!\S){char_class(punctuation)}*{letter}"
+    rf"{char_class(punctuation + ''.join(transliteration_table))}*(?!\S)"
+)
+# Same, but a word is first cut at its first quote (handle_contraction), so
+# the quotes are not punctuation here and only the part before them is kept.
+unquoted_punctuation = "".join(char for char in punctuation if char not in quote_vars)
+tokenize_pattern = re.compile(
+    rf"(?<!\S)({char_class(unquoted_punctuation)}*{letter}"
+    rf"{char_class(unquoted_punctuation + ''.join(transliteration_table))}*)"
+    rf"(?:{char_class(quote_vars)}\S*)?(?!\S)"
+)
 
 
 class TigMorphPreprocess:
@@ -12,8 +81,14 @@ class TigMorphPreprocess:
     Works for both large text corpus and single words.
     """
 
-    def __init__(self, corpus):
+    def __init__(self, corpus, stopwords=None, stemmer=None):
+        """
+        stopwords (a set) and stemmer default to the process-wide ones from
+        resources.get_resources(), so preprocessing does no file I/O.
+        """
         self.corpus = corpus
+        self.stopwords = stopwords
+        self.stemmer = stemmer
 
     def handle_contraction(self):
         """
@@ -23,15 +98,6 @@ class TigMorphPreprocess:
         Operates on word level.
         Removes single quotes along with succeeding portions of
         """
-        quote_vars = [
-            "\u0027",
-            "\u2018",
-            "\u2019",
-            "\u2032",
-            "\u02BC",
-            "\u0060",
-            "\u00B4",
-        ]
         split_corpus = self.corpus.split()
         remove_contraction = lambda word: next(
             (word.split(char)[0] for char in word if char in quote_vars), word
@@ -44,53 +110,10 @@ class TigMorphPreprocess:
         Removes English & Ethiopic punctuation marks.
         Removes words containing a non-alphabetic character.
         """
-
-        english_punctuation = "".join(
-            [
-                "\u002E",  # Period.
-                "\u002C",  # Comma.
-                "\u0021",  # Exclamation Mark.
-                "\u003F",  # Question Mark.
-                "\u003A",  # Colon.
-                "\u003B",  # Semicolon.
-                "\u0027",  # Apostrophe.
-                "\u0022",  # Double Quotation Mark.
-                "\u201C",  # Left Double Quotation Mark.
-                "\u201D",  # Right Double Quotation Mark.
-                "\u2018",  # Left Single Quotation Mark.
-                "\u2019",  # Right Single Quotation Mark.
-                "\u2010",  # Hyphen.
-                "\u2013",  # En Dash.
-                "\u2014",  # Em Dash.
-                "\u0028",  # Left Parenthesis.
-                "\u0029",  # Right Parenthesis.
-                "\u005B",  # Left Square Bracket.
-                "\u005D",  # Right Square Bracket.
-                "\u007B",  # Left Curly Bracket.
-                "\u007D",  # Right Curly Bracket.
-                "\u2026",  # Ellipsis.
-                "\u002F",  # Slash
-                "\u005C",  # Backslash
-                "\u0026",  # Ampersand
-                "\u002A",  # Asterisk
-            ]
-        )
-        eng_pattern = f"[{re.escape(english_punctuation)}]"
-        filtered_corpus0 = re.sub(eng_pattern, "", self.corpus)
-
-        eth_pattern = r"[\u1361-\u1368]+"
-        filtered_corpus1 = re.sub(eth_pattern, "", filtered_corpus0)
-
-        ethiopic_letters = load_json_file("SERA_transliteration.json")
-
-        # remove any word containing a non-alphabetic character
         # think hard about why we removed punctuations first
-        filtered_corpus_final = []
-        for word in filtered_corpus1.split():
-            if all(char in ethiopic_letters.keys() for char in word):
-                filtered_corpus_final.append(word)
-
-        self.corpus = " ".join(filtered_corpus_final)
+        self.corpus = " ".join(filter_pattern.findall(self.corpus)).translate(
+            punctuation_table
+        )
 
     # NOTE - keeping dates is not worth the added complexity, as a result we have decided to remove them
     # Task 1
@@ -98,16 +121,16 @@ class TigMorphPreprocess:
         """
         Handles Tigrinya specific contractions.
         Removes words containing non-alphabet characters from corpus.
+
+        Same result as handle_contraction followed by filter_text, in one
+        regex pass over the corpus.
         """
-        self.handle_contraction()
-        self.filter_text()
+        self.corpus = " ".join(tokenize_pattern.findall(self.corpus)).translate(
+            punctuation_table
+        )
 
         return self
 
-    def normalize_helper(self, list1: list, list2: list):
-        for i in range(len(list1)):
-            self.corpus = self.corpus.replace(list1[i], list2[i])
-
     # REVIEW - Normalization of Tigrinya text can be further enhanced by...
     # converging Tigrinya-specific abbreviations of different form.
     # (eg. ገ/ስላሴ --> ገብረስላሴ)
@@ -115,33 +138,9 @@ class TigMorphPreprocess:
     def normalize(self):
         """
         Converges similar sounding characters.
+        The character mapping is compiled once in helper_functions.
         """
-        h1 = ["ሐ", "ሑ", "ሒ", "ሓ", "ሔ", "ሕ", "ሖ", "ሗ", "ሗ"]
-        h2 = ["ሀ", "ሁ", "ሂ", "ሃ", "ሄ", "ህ", "ሆ", "ሗ", "ሗ"]
-        h3 = ["ኀ", "ኁ", "ኂ", "ኃ", "ኄ", "ኅ", "ኆ", "ኇ", "ኋ"]
-
-        s1 = ["ሰ", "ሱ", "ሲ", "ሳ", "ሴ", "ስ", "ሶ", "ሷ"]
-        s2 = ["ሠ", "ሡ", "ሢ", "ሣ", "ሤ", "ሥ", "ሦ", "ሧ"]
-
-        q1 = ["ቀ", "ቁ", "ቂ", "ቃ", "ቄ", "ቅ", "ቆ", "ቈ", "ቊ", "ቋ", "ቌ", "ቍ"]
-        q2 = ["ቐ", "ቑ", "ቒ", "ቓ", "ቔ", "ቕ", "ቖ", "ቘ", "ቚ", "ቛ", "ቜ", "ቝ"]
-
-        a1 = ["አ", "ኡ", "ኢ", "ኣ", "ኤ", "እ", "ኦ"]
-        a2 = ["ዐ", "ዑ", "ዒ", "ዓ", "ዔ", "ዕ", "ዖ"]
-
-        ts1 = ["ጸ", "ጹ", "ጺ", "ጻ", "ጼ", "ጽ", "ጾ", "ጿ"]
-        ts2 = ["ፀ", "ፁ", "ፂ", "ፃ", "ፄ", "ፅ", "ፆ", "ጿ"]
-
-        exp1 = ["ጓ", "ቋ"]
-        exp2 = ["ጏ", "ቇ"]
-
-        self.normalize_helper(h2, h1)
-        self.normalize_helper(h3, h1)
-        self.normalize_helper(s2, s1)
-        self.normalize_helper(q2, q1)
-        self.normalize_helper(a2, a1)
-        self.normalize_helper(ts2, ts1)
-        self.normalize_helper(exp2, exp1)
+        self.corpus = normalize(self.corpus)
 
         return self
 
@@ -150,16 +149,22 @@ class TigMorphPreprocess:
         """
         Removes
         - predefined stopwords from the corpus
+
+        Operates on word level: a word is dropped only if it is a stopword as
+        a whole, never parts of other words.
         """
-        stopwords = load_txt_file("lists/stopword_list.txt")
+        stopwords = self.stopwords
+        if stopwords is None:
+            stopwords = get_resources().stopwords
 
-        for stopword in stopwords:
-            self.corpus = self.corpus.replace(stopword, "")
+        self.corpus = " ".join(
+            word for word in self.corpus.split() if word not in stopwords
+        )
 
         return self
 
     # Task 4
-    def stem(self):
+    def stem(self, percentile_threshold=10):
         """
         Stems words in corpus
         Removes
@@ -167,27 +172,20 @@ class TigMorphPreprocess:
         - tokens with frequencies below the given percentile threshold
         """
 
-        prefix_suffix_pairs = [
-            ("መ", "ቲ"),
-            ("መ", "ያ"),
-            ("መ", "ኢ"),
-            ("መ", "ታ"),
-            ("መ", "ት"),
-        ]
-        prefix_list = load_txt_file("lists/prefix_list.txt")
-        suffix_list = load_txt_file("lists/suffix_list.txt")
-
-        stemmer = TigrinyaStemmer(prefix_suffix_pairs, prefix_list, suffix_list)
+        stemmer = self.stemmer
+        if stemmer is None:
+            stemmer = get_resources().stemmer
         tokens = list(map(stemmer.stem, self.corpus.split()))
 
-        percentile_threshold = 10
+        if not tokens:
+            self.corpus = tokens
+            return self
 
         # Calculate the frequency of each word in the corpus
         word_freq = Counter(tokens)
 
         # Determine the frequency threshold based on the given percentile
-        frequencies = list(word_freq.values())
-        threshold_value = np.percentile(frequencies, percentile_threshold)
+        threshold_value = frequency_threshold(word_freq, percentile_threshold)
 
         # Filter out words with length < 3 and those below the frequency threshold
         filtered_tokens = [
@@ -203,8 +201,159 @@ class TigMorphPreprocess:
     def get_result(self):
         return self.corpus
 
-def main():
-    corpus = """
+
+def frequency_threshold(word_freq, percentile_threshold=10):
+    """Token frequency below which the stem stage drops a token."""
+    return np.percentile(list(word_freq.values()), percentile_threshold)
+
+
+# Streaming API
+# The stages of TigMorphPreprocess as generators over tokens, for documents
+# too large to hold as one string. Every stage before the frequency filter
+# works on one word at a time, so they chain without building the corpus.
+
+
+def read_chunks(file, chunk_size=2**16):
+    """
+    Yields the text of an open file in chunks of about chunk_size characters
+    that end on whitespace, so that no word is split across two chunks.
+    """
+    rest = ""
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+
+        end = len(chunk)
+        while end and not chunk[end - 1].isspace():
+            end -= 1
+        if end == 0:
+            # the chunk is the middle of a word
+            rest += chunk
+            continue
+
+        yield rest + chunk[:end]
+        rest = chunk[end:]
+
+    if rest:
+        yield rest
+
+
+def read_pages(file, chunk_size=2**16):
+    """
+    read_chunks, with the page of every chunk: yields (page number, chunk).
+    Pages end with a form feed, as pdf2txt writes them, and are numbered
+    from 1; a text without form feeds is a single page.
+    """
+    page = 1
+    for chunk in read_chunks(file, chunk_size):
+        for i, part in enumerate(chunk.split("\f")):
+            if i:
+                page += 1
+            if part:
+                yield page, part
+
+
+def tokenize_stream(chunks):
+    """TigMorphPreprocess.tokenize over chunks of text, one token at a time."""
+    for chunk in chunks:
+        words = " ".join(tokenize_pattern.findall(chunk))
+        yield from words.translate(punctuation_table).split()
+
+
+def normalize_stream(tokens):
+    # tokens are words, which normalize always translates
+    return map(str.translate, tokens, repeat(normalization_table))
+
+
+def remove_stopwords_stream(tokens, stopwords=None):
+    if stopwords is None:
+        stopwords = get_resources().stopwords
+    return (token for token in tokens if token not in stopwords)
+
+
+def stem_stream(tokens, stemmer=None):
+    """Stems tokens, without the frequency filter of TigMorphPreprocess.stem."""
+    if stemmer is None:
+        stemmer = get_resources().stemmer
+    return map(stemmer.stem, tokens)
+
+
+def preprocess_stream(chunks, stopwords=None, stemmer=None):
+    """tokenize, normalize, remove_stopwords and stem, as one token generator."""
+    tokens = tokenize_stream(chunks)
+    tokens = normalize_stream(tokens)
+    tokens = remove_stopwords_stream(tokens, stopwords)
+    return stem_stream(tokens, stemmer)
+
+
+def preprocess_file(file_path, percentile_threshold=10, chunk_size=2**16):
+    """
+    Yields the same tokens as
+    TigMorphPreprocess(text).tokenize().normalize().remove_stopwords().stem()
+    on the text of file_path, reading it in chunks.
+
+    The frequency filter needs the frequency of every stem before it can let
+    the first token through, so the file is read twice: once to count the
+    stems and once to yield them. Memory is bounded by the number of distinct
+    stems (and the stemmer cache), not by the size of the document.
+    """
+    for _, token in preprocess_file_pages(file_path, percentile_threshold, chunk_size):
+        yield token
+
+
+def preprocess_file_pages(file_path, percentile_threshold=10, chunk_size=2**16):
+    """
+    preprocess_file, with the page of every token: yields (page number, token).
+    The frequency filter still counts the stems of the whole document, so
+    the tokens are the same as preprocess_file's.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        word_freq = Counter(preprocess_stream(read_chunks(file, chunk_size)))
+    if not word_freq:
+        return
+
+    threshold_value = frequency_threshold(word_freq, percentile_threshold)
+    with open(file_path, "r", encoding="utf-8") as file:
+        for page, chunk in read_pages(file, chunk_size):
+            for token in preprocess_stream([chunk]):
+                if len(token) >= 3 and word_freq[token] >= threshold_value:
+                    yield page, token
+
+
+def preprocess_text_pages(text, percentile_threshold=10, stopwords=None, stemmer=None):
+    """
+    preprocess_file_pages over a text held in memory: each page goes through
+    the string stages of TigMorphPreprocess at once, which is faster than the
+    token generators for texts that fit in memory.
+    """
+    if stemmer is None:
+        stemmer = get_resources().stemmer
+
+    page_stems = [
+        list(map(stemmer.stem, corpus.split()))
+        for corpus in (
+            TigMorphPreprocess(page_text, stopwords, stemmer)
+            .tokenize()
+            .normalize()
+            .remove_stopwords()
+            .get_result()
+            for page_text in text.split("\f")
+        )
+    ]
+
+    word_freq = Counter(token for stems in page_stems for token in stems)
+    if not word_freq:
+        return
+
+    threshold_value = frequency_threshold(word_freq, percentile_threshold)
+    for page, stems in enumerate(page_stems, 1):
+        for token in stems:
+            if len(token) >= 3 and word_freq[token] >= threshold_value:
+                yield page, token
+
+
+SAMPLE_CORPUS = """
     ቤተ - መንግስቲ ዋይት ሃውስ ኣብ ዘውጸኦ መግለጺ ፡ “ዋና ኣኽባር ሕጊ ሳሊ ያትስ ንምምሕዳር ትራምፕ ከዲዓቶ” ብምባል ስራሕ ደው ከተብል ተወሲኑ ምህላዉ ኣፍሊጡ ።
     ፕረዚደንት ትራምፕ ፡ ኣብዚ ሰሙን’ዚ ዜጋታት ኢራን ፡ ሊብያ ፡ ሶማል ፡ ሱዳን ፡ የመን ፡ ዒራቕን ሶርያን ናብ ኣመሪካ ከይኣትዉ ዝኽልክል ትእዛዝ ከም ዘመሓላለፈ ዝፍለጥ እዩ ።
     መራሕቲ ሃገራት ኣፍሪቃ ኣብ ዘካየድዎ መስርሕ ምድማጽ ፡ ሞሮኮ ዳግማይ ናብ ኣፍሪቃዊ ሕብረት ክትጽንበር ደጊፎም ።
@@ -227,7 +376,33 @@ def main():
     እቲ ቻይናዊ ቅኑዕን ጻዕራምን ምዃኑ ጐረባብቱ ይምስክርሉ ።
     """
 
-    psr = TigMorphPreprocess(corpus)
+
+def main():
+    # NOTE - the fused tokenize must match its two separate steps
+    sample = TigMorphPreprocess(SAMPLE_CORPUS).tokenize().get_result()
+    psr = TigMorphPreprocess(SAMPLE_CORPUS)
+    psr.handle_contraction()
+    psr.filter_text()
+    if sample != psr.get_result():
+        print("Error: tokenize and handle_contraction + filter_text disagree")
+
+    # NOTE - the streaming stages must match the string pipeline
+    words = TigMorphPreprocess(SAMPLE_CORPUS).tokenize().normalize()
+    words = words.remove_stopwords().get_result().split()
+    stems = list(map(get_resources().stemmer.stem, words))
+    if stems != list(preprocess_stream(read_chunks(io.StringIO(SAMPLE_CORPUS), 64))):
+        print("Error: preprocess_stream and TigMorphPreprocess disagree")
+
+    # NOTE - splitting the text into pages must not change its tokens
+    pages = read_pages(io.StringIO(SAMPLE_CORPUS.replace("።\n", "።\n\f")), 64)
+    if stems != [token for _, chunk in pages for token in preprocess_stream([chunk])]:
+        print("Error: read_pages changes the tokens of the text")
+
+    # NOTE - the compiled normalization must match the sequential replacements
+    if normalize(sample) != normalize_sequential(sample):
+        print("Error: normalize and normalize_sequential disagree on the sample")
+
+    psr = TigMorphPreprocess(SAMPLE_CORPUS)
     psr.tokenize().normalize().remove_stopwords().stem()
     tokens = psr.get_result()
 
@@ -0,0 +1,80 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class QueryCache:
+    """
+    Results of recent queries, evicted least recently used first once there
+    are max_size of them, and expired ttl seconds after they were computed.
+
+    Keys are built with query_key, so they contain the version of the index
+    the results came from: results of an index that was replaced can never
+    be returned, they only wait to be evicted (or cleared).
+    Safe to share between the threads of a server.
+    """
+
+    def __init__(self, max_size=4096, ttl=600.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (expiry time, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """The cached value of key, None if there is none or it expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        # counters of one moment, not changed by a get or put halfway
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+def query_key(index_version, query_tokens, *options):
+    """
+    Cache key of a query: the query's preprocessed tokens, sorted since
+    scores do not depend on their order, with the index version and the
+    ranking options (mode, k, ...) that change the results.
+    """
+    return (index_version, tuple(sorted(query_tokens)), *options)
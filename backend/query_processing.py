@@ -0,0 +1,295 @@
+from collections import Counter
+import heapq
+import random
+import sys
+import time
+
+import numpy as np
+
+from .inverted_index import END_OF_POSTINGS, InvertedIndex
+from .scoring import bm25_idf, bm25_term_weights, tf_idf_weights
+
+
+# upper bounds are widened by this factor so that rounding in the summation
+# order can never make a bound smaller than the score it is bounding
+BOUND_SLACK = 1 + 1e-9
+
+
+class TfIdfCosineScorer:
+    """
+    TF-IDF cosine similarity, decomposed per term:
+    score(d) = sum_t w_q(t) * tf(t, d) / len(d) * idf(t) / norm(d)
+    The query norm is left out while ranking (it does not change the order)
+    and applied once to the final top k.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.doc_lengths = np.asarray(index.doc_lengths)
+        self.doc_norms = np.asarray(index.doc_norms)
+        # 1 / (len(d) * norm(d)) as plain floats for the per-posting path
+        self._posting_factors = np.divide(
+            1.0,
+            self.doc_lengths * self.doc_norms,
+            out=np.zeros(len(self.doc_norms)),
+            where=self.doc_norms > 0,
+        ).tolist()
+
+    def query_weights(self, query_tokens):
+        """{term: query weight} of the in-vocabulary query terms."""
+        weights = {}
+        for term, freq in Counter(query_tokens).items():
+            term_id = self.index.term_ids.get(term)
+            if term_id is not None:
+                weights[term] = freq * self.index.idf[term_id]
+        return weights
+
+    def upper_bound(self, term, query_weight):
+        return query_weight * self.index.max_weights[self.index.term_ids[term]]
+
+    def term_scores(self, term, query_weight, doc_ids, tfs):
+        """Contribution of term to the score of each of doc_ids."""
+        idf = self.index.idf[self.index.term_ids[term]]
+        norms = self.doc_norms[doc_ids]
+        weights = query_weight * tf_idf_weights(tfs, self.doc_lengths[doc_ids], idf)
+        return np.divide(weights, norms, out=np.zeros_like(weights), where=norms > 0)
+
+    def posting_score(self, term, query_weight, doc_id, tf):
+        """term_scores for a single posting."""
+        idf = self.index.idf[self.index.term_ids[term]]
+        return query_weight * idf * tf * self._posting_factors[doc_id]
+
+    def finalize(self, query_weights, scores):
+        query_norm = np.sqrt(sum(weight**2 for weight in query_weights.values()))
+        return [score / query_norm for score in scores]
+
+
+class BM25Scorer:
+    """
+    BM25 with the document lengths stored in the index. A term's upper bound
+    is its weight at its largest tf in its shortest document.
+    """
+
+    def __init__(self, index, k1=1.2, b=0.75):
+        self.index = index
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths = np.asarray(index.doc_lengths)
+        self.avg_doc_length = self.doc_lengths.mean()
+        self.idf = bm25_idf(index.num_docs, np.asarray(index.lexicon[:-1, 1]))
+        self._doc_lengths = self.doc_lengths.tolist()
+
+    def query_weights(self, query_tokens):
+        """{term: frequency in the query} of the in-vocabulary query terms."""
+        return {
+            term: freq
+            for term, freq in Counter(query_tokens).items()
+            if term in self.index.term_ids
+        }
+
+    def _weights(self, term, tfs, doc_lengths):
+        idf = self.idf[self.index.term_ids[term]]
+        return bm25_term_weights(
+            tfs, doc_lengths, self.avg_doc_length, idf, self.k1, self.b
+        )
+
+    def upper_bound(self, term, query_weight):
+        term_id = self.index.term_ids[term]
+        return query_weight * self._weights(
+            term, self.index.max_tfs[term_id], self.index.min_lengths[term_id]
+        )
+
+    def term_scores(self, term, query_weight, doc_ids, tfs):
+        return query_weight * self._weights(term, tfs, self.doc_lengths[doc_ids])
+
+    def posting_score(self, term, query_weight, doc_id, tf):
+        return query_weight * self._weights(term, tf, self._doc_lengths[doc_id])
+
+    def finalize(self, query_weights, scores):
+        return scores
+
+
+SCORERS = {"cosine": TfIdfCosineScorer, "bm25": BM25Scorer}
+
+
+def exhaustive_top_k(index, query_tokens, k=10, scorer=None):
+    """
+    Reference query processor: scores every posting of every query term.
+    Returns ([(document ordinal, score)] best first, number of postings scored).
+    """
+    scorer = scorer or TfIdfCosineScorer(index)
+    query_weights = scorer.query_weights(query_tokens)
+
+    doc_ids, contributions = [], []
+    for term, weight in query_weights.items():
+        postings = index.postings(term)
+        doc_ids.append(postings.doc_ids)
+        contributions.append(
+            scorer.term_scores(term, weight, postings.doc_ids, postings.tfs)
+        )
+    if not doc_ids:
+        return [], 0
+
+    candidates, positions = np.unique(np.concatenate(doc_ids), return_inverse=True)
+    scores = np.bincount(positions, weights=np.concatenate(contributions))
+
+    best = [
+        (int(candidates[i]), scores[i])
+        for i in np.lexsort((candidates, -scores))[:k]
+        if scores[i] > 0
+    ]
+    final = scorer.finalize(query_weights, [score for _, score in best])
+    return [(doc_id, score) for (doc_id, _), score in zip(best, final)], len(positions)
+
+
+class _TermCursor:
+    def __init__(self, term, cursor, query_weight, upper_bound):
+        self.term = term
+        self.cursor = cursor
+        self.query_weight = query_weight
+        self.upper_bound = upper_bound
+
+
+def wand_top_k(index, query_tokens, k=10, scorer=None):
+    """
+    Document-at-a-time WAND (Broder et al., 2003).
+
+    Cursors are kept sorted by their current document. The pivot is the first
+    cursor at which the summed upper bounds of the cursors before it exceed
+    the score of the current k-th best document: no document before the pivot
+    document can enter the top k, so the lagging cursors jump straight to it
+    through the skip pointers. Only documents that might enter the top k are
+    fully scored, and the result is identical to exhaustive_top_k.
+
+    An experiment, used only by the benchmark of main: SearchEngine and
+    /search do not call it. It scores far fewer postings than
+    exhaustive_top_k, but moving the cursors one pivot at a time in Python
+    costs more than numpy scoring every posting, so it is 1.5-3x slower in
+    wall time at every query length on the test indexes.
+
+    Returns ([(document ordinal, score)] best first, number of postings scored).
+    """
+    scorer = scorer or TfIdfCosineScorer(index)
+    query_weights = scorer.query_weights(query_tokens)
+
+    cursors = [
+        _TermCursor(term, index.cursor(term), weight, scorer.upper_bound(term, weight))
+        for term, weight in query_weights.items()
+    ]
+    cursors = [term_cursor for term_cursor in cursors if term_cursor.upper_bound > 0]
+
+    # min-heap of (score, -document ordinal): the root is the current k-th best,
+    # and on equal scores the later document is the one to evict
+    heap = []
+    threshold = 0.0
+    scored_postings = 0
+
+    while True:
+        cursors.sort(key=lambda term_cursor: term_cursor.cursor.doc)
+
+        # find the pivot
+        bound = 0.0
+        pivot = None
+        for i, term_cursor in enumerate(cursors):
+            if term_cursor.cursor.doc == END_OF_POSTINGS:
+                break
+            bound += term_cursor.upper_bound * BOUND_SLACK
+            if bound > threshold:
+                pivot = i
+                break
+        if pivot is None:
+            break
+
+        pivot_doc = cursors[pivot].cursor.doc
+        if cursors[0].cursor.doc == pivot_doc:
+            # every cursor up to the pivot is on pivot_doc: score it fully
+            score = 0.0
+            for term_cursor in cursors:
+                cursor = term_cursor.cursor
+                if cursor.doc != pivot_doc:
+                    break
+                score += scorer.posting_score(
+                    term_cursor.term, term_cursor.query_weight, pivot_doc, cursor.tf
+                )
+                scored_postings += 1
+                cursor.next()
+
+            entry = (score, -pivot_doc)
+            if score > 0 and len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif score > 0 and entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+            if len(heap) == k:
+                threshold = heap[0][0]
+        else:
+            # move the lagging cursor with the longest list (the one that
+            # skips the most postings) up to the pivot document
+            lagging = max(
+                (
+                    term_cursor
+                    for term_cursor in cursors[:pivot]
+                    if term_cursor.cursor.doc < pivot_doc
+                ),
+                key=lambda term_cursor: term_cursor.cursor.df,
+            )
+            lagging.cursor.next_geq(pivot_doc)
+
+    best = sorted(heap, key=lambda entry: (-entry[0], -entry[1]))
+    final = scorer.finalize(query_weights, [score for score, _ in best])
+    return [(-neg_doc, score) for (_, neg_doc), score in zip(best, final)], (
+        scored_postings
+    )
+
+
+def sample_queries(index, num_queries, query_length, seed=0):
+    """Random queries whose terms are drawn proportionally to their df."""
+    rng = random.Random(seed)
+    df = [int(df) for df in index.lexicon[:-1, 1]]
+    return [
+        rng.choices(index.terms, weights=df, k=query_length) for _ in range(num_queries)
+    ]
+
+
+# NOTE - benchmarking WAND against exhaustive scoring, the only use of
+# wand_top_k: the search engine ranks with the sparse index
+def main(index_dir="inverted_index", ranking="cosine", num_queries=200, k=10):
+    index = InvertedIndex(index_dir)
+    scorer = SCORERS[ranking](index)
+    print(f"{index.num_docs} documents, {index.num_terms} terms, top {k}, {ranking}")
+    print("terms  exhaustive ms  wand ms  exhaustive postings  wand postings")
+
+    for query_length in (1, 2, 3, 4, 6, 8, 12):
+        queries = sample_queries(index, num_queries, query_length)
+        totals = {"exhaustive": [0.0, 0], "wand": [0.0, 0]}
+
+        for query in queries:
+            results = {}
+            for name, top_k in (("exhaustive", exhaustive_top_k), ("wand", wand_top_k)):
+                start = time.perf_counter()
+                results[name], postings = top_k(index, query, k, scorer)
+                totals[name][0] += time.perf_counter() - start
+                totals[name][1] += postings
+
+            expected = [doc_id for doc_id, _ in results["exhaustive"]]
+            found = [doc_id for doc_id, _ in results["wand"]]
+            # ties may be broken differently, the scores must still agree
+            if len(expected) != len(found) or (
+                expected != found
+                and not np.allclose(
+                    [score for _, score in results["exhaustive"]],
+                    [score for _, score in results["wand"]],
+                )
+            ):
+                print(f"Error: WAND and exhaustive top {k} differ for {query}")
+
+        print(
+            f"{query_length:5d}  "
+            f"{1000 * totals['exhaustive'][0] / num_queries:13.2f}  "
+            f"{1000 * totals['wand'][0] / num_queries:7.2f}  "
+            f"{totals['exhaustive'][1] / num_queries:19.1f}  "
+            f"{totals['wand'][1] / num_queries:13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
@@ -0,0 +1,101 @@
+import os
+import threading
+from types import MappingProxyType
+from typing import NamedTuple
+
+from .helper_functions import (
+    current_dir,
+    load_txt_file,
+    normalize,
+    transcription_table,
+    transliteration_table,
+)
+from .tig_stemmer import TigrinyaStemmer
+
+
+PREFIX_SUFFIX_PAIRS = (
+    ("መ", "ቲ"),
+    ("መ", "ያ"),
+    ("መ", "ኢ"),
+    ("መ", "ታ"),
+    ("መ", "ት"),
+)
+
+LIST_FILES = (
+    "lists/prefix_list.txt",
+    "lists/suffix_list.txt",
+    "lists/stopword_list.txt",
+)
+
+
+class Resources(NamedTuple):
+    """Read-only preprocessing resources shared by the whole process."""
+
+    alphabet: frozenset
+    transliteration_table: MappingProxyType
+    transcription_table: MappingProxyType
+    prefix_list: tuple
+    suffix_list: tuple
+    prefix_suffix_pairs: tuple
+    stopwords: frozenset
+    stemmer: TigrinyaStemmer
+
+
+_resources = None
+_list_mtimes = None
+_lock = threading.Lock()
+
+
+def _list_file_mtimes():
+    return tuple(
+        os.path.getmtime(os.path.join(current_dir, file_name))
+        for file_name in LIST_FILES
+    )
+
+
+def _load_resources():
+    prefix_list = tuple(load_txt_file("lists/prefix_list.txt"))
+    suffix_list = tuple(load_txt_file("lists/suffix_list.txt"))
+    stopwords = load_txt_file("lists/stopword_list.txt")
+
+    return Resources(
+        alphabet=frozenset(transliteration_table),
+        transliteration_table=MappingProxyType(transliteration_table),
+        transcription_table=MappingProxyType(transcription_table),
+        prefix_list=prefix_list,
+        suffix_list=suffix_list,
+        prefix_suffix_pairs=PREFIX_SUFFIX_PAIRS,
+        # stopwords are removed after normalization, keep both forms
+        stopwords=frozenset(stopwords) | frozenset(map(normalize, stopwords)),
+        stemmer=TigrinyaStemmer(PREFIX_SUFFIX_PAIRS, prefix_list, suffix_list),
+    )
+
+
+def get_resources():
+    """
+    The process-wide Resources, loaded from lists/ on first use.
+    Later calls do no file I/O.
+    """
+    global _resources, _list_mtimes
+    if _resources is None:
+        with _lock:
+            if _resources is None:
+                _list_mtimes = _list_file_mtimes()
+                _resources = _load_resources()
+    return _resources
+
+
+def reload_if_changed():
+    """
+    Reloads the resources if any of the list files changed since they were
+    loaded. Meant to be called periodically by long-running processes, not on
+    every query. Returns True if the resources were reloaded.
+    """
+    global _resources, _list_mtimes
+    with _lock:
+        mtimes = _list_file_mtimes()
+        if _resources is not None and mtimes == _list_mtimes:
+            return False
+        _list_mtimes = mtimes
+        _resources = _load_resources()
+        return True
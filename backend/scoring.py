@@ -0,0 +1,291 @@
+import numpy as np
+
+
+def cosine_scores(index, query_weights):
+    """
+    Sparse matrix-vector product between the query and the term-major index.
+
+    query_weights: {term_id: weight}
+    Returns (document ordinals, cosine similarities) of the documents sharing
+    at least one term with the query. Only the postings of the query terms are
+    read, so the cost grows with their total length and not with the size of
+    the vocabulary or the collection.
+    """
+    if not query_weights:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+    doc_ids, contributions = [], []
+    for term_id, weight in query_weights.items():
+        term_doc_ids, term_doc_weights = index.postings(term_id)
+        doc_ids.append(term_doc_ids)
+        contributions.append(weight * term_doc_weights.astype(np.float64))
+
+    candidates, positions = np.unique(np.concatenate(doc_ids), return_inverse=True)
+    dot_products = np.bincount(positions, weights=np.concatenate(contributions))
+
+    query_norm = np.sqrt(sum(weight**2 for weight in query_weights.values()))
+    norms = query_norm * index.doc_norms[candidates]
+    scores = np.divide(
+        dot_products, norms, out=np.zeros_like(dot_products), where=norms > 0
+    )
+    return candidates, scores
+
+
+def top_k(doc_ids, scores, k):
+    """
+    The k best (document ordinal, score) pairs, best first.
+    Partial selection keeps this O(n + k log k) instead of sorting everything;
+    ties are broken by document ordinal so results are deterministic.
+    """
+    keep = scores > 0
+    doc_ids, scores = doc_ids[keep], scores[keep]
+
+    if len(scores) > k:
+        # everything tied with the k-th best score, so that the tie is
+        # broken by document ordinal rather than by partition order
+        kth_score = -np.partition(-scores, k - 1)[k - 1]
+        selected = np.flatnonzero(scores >= kth_score)
+    else:
+        selected = np.arange(len(scores))
+
+    order = selected[np.lexsort((doc_ids[selected], -scores[selected]))][:k]
+    return doc_ids[order], scores[order]
+
+
+def query_matrix(queries):
+    """
+    Sparse matrix of a batch of queries in coordinate form.
+    queries: [{term_id: value}], one dict per row
+    Returns (rows, term ids, values) in row order, and in dict order within
+    a row.
+    """
+    rows = np.repeat(np.arange(len(queries)), [len(query) for query in queries]).astype(
+        np.int64
+    )
+    term_ids = np.fromiter(
+        (term_id for query in queries for term_id in query),
+        dtype=np.int64,
+        count=len(rows),
+    )
+    values = np.fromiter(
+        (value for query in queries for value in query.values()),
+        dtype=np.float64,
+        count=len(rows),
+    )
+    return rows, term_ids, values
+
+
+def expand_postings(index, term_ids):
+    """
+    Positions in the posting arrays of the index (indices, data, counts) of
+    the postings of every one of term_ids, one run after the other, and the
+    length of each run.
+    """
+    starts = np.asarray(index.indptr[term_ids], dtype=np.int64)
+    lengths = np.asarray(index.indptr[term_ids + 1], dtype=np.int64) - starts
+    run_starts = np.cumsum(lengths) - lengths
+    positions = np.arange(lengths.sum()) + np.repeat(starts - run_starts, lengths)
+    return positions, lengths
+
+
+def sum_by_row_and_page(num_docs, rows, pages, contributions):
+    """
+    Adds up the contributions of the same (row, page) pair, in the order
+    they come. Returns (rows, pages, sums) sorted by row then page.
+    """
+    keys, positions = np.unique(rows * num_docs + pages, return_inverse=True)
+    sums = np.bincount(positions, weights=contributions)
+    return keys // num_docs, keys % num_docs, sums
+
+
+def cosine_scores_batch(index, queries):
+    """
+    cosine_scores of a batch of queries with one sparse-sparse product
+    between the query matrix and the term-major index: the postings of
+    every (query, term) entry are expanded, and the products are summed
+    per (query, page) pair.
+
+    queries: [{term_id: weight}], one dict per query
+    Returns (query rows, page ordinals, cosine similarities) sorted by row
+    then page, equal to what cosine_scores returns query by query.
+    """
+    query_rows, term_ids, weights = query_matrix(queries)
+    positions, lengths = expand_postings(index, term_ids)
+    pages = np.asarray(index.indices[positions], dtype=np.int64)
+    contributions = np.repeat(weights, lengths) * index.data[positions].astype(
+        np.float64
+    )
+
+    rows, pages, dot_products = sum_by_row_and_page(
+        index.num_docs, np.repeat(query_rows, lengths), pages, contributions
+    )
+
+    query_norms = np.sqrt(
+        np.bincount(query_rows, weights=weights**2, minlength=len(queries))
+    )
+    norms = query_norms[rows] * index.doc_norms[pages]
+    scores = np.divide(
+        dot_products, norms, out=np.zeros_like(dot_products), where=norms > 0
+    )
+    return rows, pages, scores
+
+
+def best_pages(page_ids, scores, page_documents):
+    """
+    Groups the scores of pages by document, a document scoring as its best
+    page. page_documents maps page ordinals to document ordinals.
+    Returns (document ordinals, ordinal of the best page of each, its score)
+    sorted by document ordinal; ties go to the first page.
+    """
+    documents = page_documents[page_ids]
+    order = np.lexsort((page_ids, -scores, documents))
+    documents, page_ids, scores = documents[order], page_ids[order], scores[order]
+
+    best = np.ones(len(documents), dtype=bool)
+    best[1:] = documents[1:] != documents[:-1]
+    return documents[best], page_ids[best], scores[best]
+
+
+def top_k_documents(page_ids, scores, page_documents, k):
+    """
+    top_k over documents scored as their best page.
+    Returns (document ordinals, best page ordinals, scores), best first.
+    """
+    document_ids, page_ids, scores = best_pages(page_ids, scores, page_documents)
+    top_document_ids, top_scores = top_k(document_ids, scores, k)
+    return (
+        top_document_ids,
+        page_ids[np.searchsorted(document_ids, top_document_ids)],
+        top_scores,
+    )
+
+
+def log_idf(num_docs, df):
+    """idf of the tf-idf weights, log(N / df)."""
+    return np.log(num_docs / df)
+
+
+def tf_idf_weights(counts, doc_lengths, idf):
+    """
+    tf-idf weight of one or more postings, with tf = count / length, as
+    stored in the sparse index and in the inverted index's statistics.
+    """
+    return counts / doc_lengths * idf
+
+
+def bm25_idf(num_docs, df):
+    """Robertson-Sparck Jones idf, kept non-negative for very common terms."""
+    return np.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+
+
+def bm25_term_weights(tfs, doc_lengths, avg_doc_length, idf, k1=1.2, b=0.75):
+    """
+    BM25 weight of one term in each of the given documents.
+    tfs and doc_lengths are passed in rather than read from the index so a
+    BM25F caller can hand over field-weighted frequencies and lengths instead.
+    """
+    length_norm = k1 * (1 - b + b * doc_lengths / avg_doc_length)
+    return idf * tfs * (k1 + 1) / (tfs + length_norm)
+
+
+def bm25_scores(index, query_term_freqs, idf, k1=1.2, b=0.75):
+    """
+    BM25 scores of the documents sharing at least one term with the query.
+
+    query_term_freqs: {term_id: frequency of the term in the query}
+    idf: bm25_idf of every term
+    Document lengths and the average document length come from the index, so
+    no per-document normalisation is computed at query time.
+    """
+    if not query_term_freqs:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+    doc_ids, contributions = [], []
+    for term_id, freq in query_term_freqs.items():
+        term_doc_ids, _ = index.postings(term_id)
+        weights = bm25_term_weights(
+            index.term_counts(term_id).astype(np.float64),
+            index.doc_lengths[term_doc_ids],
+            index.avg_doc_length,
+            idf[term_id],
+            k1,
+            b,
+        )
+        doc_ids.append(term_doc_ids)
+        contributions.append(freq * weights)
+
+    candidates, positions = np.unique(np.concatenate(doc_ids), return_inverse=True)
+    scores = np.bincount(positions, weights=np.concatenate(contributions))
+    return candidates, scores
+
+
+def bm25_scores_batch(index, queries, idf, k1=1.2, b=0.75):
+    """
+    bm25_scores of a batch of queries with one sparse-sparse product, as in
+    cosine_scores_batch.
+
+    queries: [{term_id: frequency of the term in the query}], one per query
+    Returns (query rows, page ordinals, scores) sorted by row then page.
+    """
+    query_rows, term_ids, freqs = query_matrix(queries)
+    positions, lengths = expand_postings(index, term_ids)
+    pages = np.asarray(index.indices[positions], dtype=np.int64)
+    weights = bm25_term_weights(
+        index.counts[positions].astype(np.float64),
+        index.doc_lengths[pages],
+        index.avg_doc_length,
+        np.repeat(idf[term_ids], lengths),
+        k1,
+        b,
+    )
+
+    return sum_by_row_and_page(
+        index.num_docs,
+        np.repeat(query_rows, lengths),
+        pages,
+        np.repeat(freqs, lengths) * weights,
+    )
+
+
+def top_k_documents_batch(rows, page_ids, scores, page_documents, num_queries, k):
+    """
+    top_k_documents of every query of a batch, from the (query rows, page
+    ordinals, scores) of cosine_scores_batch or bm25_scores_batch, which are
+    sorted by row then page. Every query is ranked at once instead of one at
+    a time.
+    Returns one (document ordinals, best page ordinals, scores) per query.
+    """
+    keep = scores > 0
+    rows, page_ids, scores = rows[keep], page_ids[keep], scores[keep]
+    documents = page_documents[page_ids]
+
+    # sorted by row then page, so the pages of a (query, document) pair are
+    # contiguous: keep the best one of each run, the first on equal scores
+    best = np.empty(0, dtype=np.int64)
+    if len(scores):
+        new_run = (rows[1:] != rows[:-1]) | (documents[1:] != documents[:-1])
+        starts = np.flatnonzero(np.concatenate(([True], new_run)))
+        run_best = np.maximum.reduceat(scores, starts)
+        lengths = np.diff(np.append(starts, len(scores)))
+        is_best = scores == np.repeat(run_best, lengths)
+        best = np.minimum.reduceat(
+            np.where(is_best, np.arange(len(scores)), len(scores)), starts
+        )
+    rows, documents = rows[best], documents[best]
+    page_ids, scores = page_ids[best], scores[best]
+
+    # documents of every query best first; the sort is stable, so ties stay
+    # in document order
+    order = np.lexsort((-scores, rows))
+    rows, documents = rows[order], documents[order]
+    page_ids, scores = page_ids[order], scores[order]
+
+    bounds = np.searchsorted(rows, np.arange(num_queries + 1))
+    return [
+        (
+            documents[start : min(end, start + k)],
+            page_ids[start : min(end, start + k)],
+            scores[start : min(end, start + k)],
+        )
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
@@ -0,0 +1,264 @@
+from collections import Counter
+import resource
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from .helper_functions import convert_date
+from .preprocessing import preprocess_stream
+from .query_cache import QueryCache, query_key
+from .resources import get_resources
+from .scoring import (
+    bm25_idf,
+    bm25_scores,
+    bm25_scores_batch,
+    cosine_scores,
+    cosine_scores_batch,
+    top_k_documents,
+    top_k_documents_batch,
+)
+from .sparse_index import SparseIndex
+
+
+RANKING_MODES = ("cosine", "bm25")
+
+
+class LoadedIndex(NamedTuple):
+    """An opened index with what is derived from it, replaced as a whole."""
+
+    index: SparseIndex
+    idf: np.ndarray
+    bm25_idf: np.ndarray
+    documents: list
+
+
+class SearchEngine:
+    """
+    Loads the index, the IDF vector, the document table and the preprocessing
+    resources once, so that answering a query only costs preprocessing the
+    query and scoring it.
+
+    Results are cached (see QueryCache) under the query's tokens, the ranking
+    options and the version of the index. The index is reopened when it is
+    rebuilt, which is checked at most every check_interval seconds, so
+    results of the previous build are never served after that.
+    """
+
+    def __init__(
+        self,
+        index_dir="tig_index",
+        top_k=10,
+        k1=1.2,
+        b=0.75,
+        cache_size=4096,
+        cache_ttl=600.0,
+        check_interval=1.0,
+    ):
+        start = time.perf_counter()
+
+        self.index_dir = index_dir
+        self.top_k = top_k
+        self.k1 = k1
+        self.b = b
+        self.cache = QueryCache(cache_size, cache_ttl)
+        self.check_interval = check_interval
+        self._next_check = time.monotonic() + check_interval
+        self._lock = threading.Lock()
+        self._loaded = self._load_index()
+
+        # warm the process-wide preprocessing resources
+        get_resources()
+
+        self.load_seconds = time.perf_counter() - start
+        # ru_maxrss is reported in kilobytes on Linux
+        self.peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def _load_index(self):
+        index = SparseIndex(self.index_dir)
+
+        # one entry per document, the index itself is made of pages
+        documents = []
+        for page_id in index.first_pages:
+            document = index.documents[page_id]
+            documents.append(
+                {
+                    "document_title": f"{convert_date(document['document_id'])} - Haddas Eritrea",
+                    "document_location": document["document_location"],
+                }
+            )
+
+        return LoadedIndex(
+            index=index,
+            idf=np.asarray(index.idf),
+            bm25_idf=bm25_idf(index.num_docs, np.asarray(index.df)),
+            documents=documents,
+        )
+
+    @property
+    def index(self):
+        return self._loaded.index
+
+    @property
+    def idf(self):
+        return self._loaded.idf
+
+    @property
+    def bm25_idf(self):
+        return self._loaded.bm25_idf
+
+    @property
+    def documents(self):
+        return self._loaded.documents
+
+    def reload_if_changed(self):
+        """
+        Reopens the index if it was rebuilt since it was opened, and drops
+        the cached results. Checks at most every check_interval seconds, so
+        it is cheap enough to call on every query. Queries already running
+        finish on the index they started with.
+        Returns True if the index was reloaded.
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        with self._lock:
+            if now < self._next_check:
+                return False
+            self._next_check = now + self.check_interval
+            if not self._loaded.index.is_stale():
+                return False
+            self._loaded = self._load_index()
+            self.cache.clear()
+            return True
+
+    def preprocess(self, query):
+        # Same tokens as
+        # TigMorphPreprocess(query).tokenize().normalize().remove_stopwords().stem(0):
+        # a query is too short for the corpus frequency cut-off, keep every
+        # token of 3 characters or more
+        return [token for token in preprocess_stream([query]) if len(token) >= 3]
+
+    def query_term_freqs(self, query_tokens, index=None):
+        """{term_id: frequency} of the in-vocabulary query terms."""
+        index = index or self.index
+        term_freqs = {}
+        for term, freq in Counter(query_tokens).items():
+            term_id = index.term_id(term)
+            if term_id is not None:
+                term_freqs[term_id] = freq
+        return term_freqs
+
+    def score(self, query_tokens, ranking="cosine", loaded=None):
+        """(page ordinals, scores) of the pages matching query_tokens."""
+        loaded = loaded or self._loaded
+        term_freqs = self.query_term_freqs(query_tokens, loaded.index)
+        if ranking == "bm25":
+            return bm25_scores(
+                loaded.index, term_freqs, loaded.bm25_idf, self.k1, self.b
+            )
+        query_weights = {
+            term_id: freq * loaded.idf[term_id] for term_id, freq in term_freqs.items()
+        }
+        return cosine_scores(loaded.index, query_weights)
+
+    def search(self, query, k=None, ranking="cosine"):
+        """
+        Returns the top k documents for query as
+        [{"document_title": ..., "document_location": ..., "page": ...}, ...]
+        A document scores as its best matching page, which document_location
+        links to. ranking is one of RANKING_MODES.
+        """
+        if ranking not in RANKING_MODES:
+            raise ValueError(f"Unknown ranking mode: {ranking}")
+
+        k = self.top_k if k is None else k
+        self.reload_if_changed()
+        loaded = self._loaded
+        query_tokens = self.preprocess(query)
+
+        key = query_key(loaded.index.version, query_tokens, ranking, k)
+        results = self.cache.get(key)
+        if results is None:
+            results = self._rank(loaded, query_tokens, k, ranking)
+            self.cache.put(key, results)
+        # callers get their own dicts, the cached ones stay as they are
+        return [dict(result) for result in results]
+
+    def search_batch(self, queries, k=None, ranking="cosine"):
+        """
+        search for each of queries, returning one list of results per query.
+        The queries that are not cached are scored together, with one
+        sparse-sparse product between their query matrix and the index,
+        which is much faster than searching them one by one.
+        """
+        if ranking not in RANKING_MODES:
+            raise ValueError(f"Unknown ranking mode: {ranking}")
+
+        k = self.top_k if k is None else k
+        self.reload_if_changed()
+        loaded = self._loaded
+
+        keys = []
+        found = {}  # cache key -> results
+        misses = {}  # cache key -> query tokens, once per distinct query
+        for query in queries:
+            query_tokens = self.preprocess(query)
+            key = query_key(loaded.index.version, query_tokens, ranking, k)
+            keys.append(key)
+            if key not in found and key not in misses:
+                results = self.cache.get(key)
+                if results is None:
+                    misses[key] = query_tokens
+                else:
+                    found[key] = results
+
+        if misses:
+            term_freqs = [
+                self.query_term_freqs(query_tokens, loaded.index)
+                for query_tokens in misses.values()
+            ]
+            if ranking == "bm25":
+                scored = bm25_scores_batch(
+                    loaded.index, term_freqs, loaded.bm25_idf, self.k1, self.b
+                )
+            else:
+                query_weights = [
+                    {
+                        term_id: freq * loaded.idf[term_id]
+                        for term_id, freq in query_term_freqs.items()
+                    }
+                    for query_term_freqs in term_freqs
+                ]
+                scored = cosine_scores_batch(loaded.index, query_weights)
+
+            top = top_k_documents_batch(
+                *scored, loaded.index.page_documents, len(misses), k
+            )
+            for key, (doc_ids, page_ids, _) in zip(misses, top):
+                found[key] = self._results(loaded, doc_ids, page_ids)
+                self.cache.put(key, found[key])
+
+        return [[dict(result) for result in found[key]] for key in keys]
+
+    def _rank(self, loaded, query_tokens, k, ranking):
+        page_ids, scores = self.score(query_tokens, ranking, loaded)
+        doc_ids, page_ids, _ = top_k_documents(
+            page_ids, scores, loaded.index.page_documents, k
+        )
+        return self._results(loaded, doc_ids, page_ids)
+
+    def _results(self, loaded, doc_ids, page_ids):
+        results = []
+        for doc_id, page_id in zip(doc_ids, page_ids):
+            document = loaded.documents[doc_id]
+            page = loaded.index.documents[page_id]["page"]
+            results.append(
+                {
+                    "document_title": document["document_title"],
+                    "document_location": f"{document['document_location']}#page={page}",
+                    "page": page,
+                }
+            )
+        return results
@@ -0,0 +1,131 @@
+import gc
+import os
+import signal
+import socket
+import sys
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from .limits import SearchLimiter
+
+
+def request_handler(read_timeout):
+    class RequestHandler(WSGIRequestHandler):
+        # drop connections that send nothing for read_timeout seconds, so
+        # slow or idle clients cannot hold the server's threads
+        timeout = read_timeout
+
+        def log_request(self, code="-", size="-"):
+            # errors are still logged, a line per request is too much here
+            pass
+
+    return RequestHandler
+
+
+def run_worker(sock, app, read_timeout):
+    # the master handles the signals, a worker just stops
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # every worker accepts connections on the socket of the master
+    server = make_server(
+        "",
+        0,
+        app,
+        threaded=True,
+        request_handler=request_handler(read_timeout),
+        fd=sock.fileno(),
+    )
+    server.serve_forever()
+
+
+def serve(
+    host="127.0.0.1",
+    port=5000,
+    workers=None,
+    max_active=4,
+    max_waiting=64,
+    timeout=10.0,
+    read_timeout=30.0,
+):
+    """
+    Serves the search API with pre-forked worker processes (os.cpu_count()
+    by default).
+
+    The engine is loaded once, by the master, before the workers are forked,
+    so they share it instead of each loading its own: the index arrays are
+    memory-mapped and live in the page cache once, and the Python objects
+    (vocabulary, document table) are shared copy-on-write. gc.freeze keeps
+    the garbage collector of the workers from writing to, and so copying,
+    the pages of those objects.
+
+    Every worker serves requests on threads and limits its searches with a
+    SearchLimiter(max_active, max_waiting, timeout). A worker that dies is
+    replaced; SIGINT or SIGTERM stops the workers, then the master.
+    """
+    from . import handle_user_query
+
+    workers = workers or os.cpu_count()
+    sock = socket.create_server((host, port), backlog=1024)
+    sock.set_inheritable(True)
+
+    gc.collect()
+    gc.freeze()
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                handle_user_query.limiter = SearchLimiter(
+                    max_active, max_waiting, timeout
+                )
+                run_worker(sock, handle_user_query.app, read_timeout)
+                status = 0
+            finally:
+                os._exit(status)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        spawn()
+    print(
+        f"Serving on http://{host}:{sock.getsockname()[1]} with {workers} workers "
+        f"(master {os.getpid()})"
+    )
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited ({status}), starting a new one")
+            spawn()
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    # usage: python -m backend.serve [workers] [port]
+    serve(
+        workers=int(sys.argv[1]) if len(sys.argv) > 1 else None,
+        port=int(sys.argv[2]) if len(sys.argv) > 2 else 5000,
+    )
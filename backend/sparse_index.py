@@ -0,0 +1,306 @@
+import json
+import os
+import uuid
+
+import numpy as np
+
+from .scoring import log_idf, tf_idf_weights
+
+
+FORMAT_NAME = "tig-sparse-index"
+FORMAT_VERSION = 4
+
+META_FILE = "meta.json"
+TERMS_FILE = "terms.txt"
+DOCUMENTS_FILE = "documents.json"
+
+# name -> dtype of every array stored next to meta.json as <name>.npy
+ARRAY_DTYPES = {
+    "indptr": np.int64,  # term t owns postings indptr[t]:indptr[t + 1]
+    "indices": np.int32,  # page ordinal of each posting
+    "data": np.float32,  # tf-idf weight of each posting
+    "counts": np.int32,  # raw term count of each posting
+    "doc_norms": np.float64,  # euclidean norm of each page vector
+    "df": np.int32,  # page frequency of each term
+    "idf": np.float64,  # idf of each term, as computed by the builder
+    "doc_lengths": np.int64,  # number of tokens of each page
+}
+
+
+def update_sparse_index(
+    index, removed_document_ids, term_counts, documents, output_dir
+):
+    """
+    Writes to output_dir the index of the collection of index (None for an
+    empty one) without the pages of removed_document_ids, and with the pages
+    of term_counts added. A document of term_counts replaces every page of
+    the document with the same id.
+
+    term_counts: {(document_id, page): {term: count}} of the pages of the new
+    or changed documents
+    documents: {document_id: document_location} of the same documents
+
+    Only those documents need to be read and counted: the counts of the
+    others come straight from the stored arrays. df, idf, weights and norms
+    change with the collection, so they are recomputed for every posting,
+    with numpy.
+
+    The index holds the tf-idf weights (scoring.tf_idf_weights) as a
+    term-major compressed sparse matrix (CSR with terms as rows, i.e. CSC of
+    the document-term matrix). The columns are pages, the units results
+    link to, keyed by (document_id, page number). They are sorted by that
+    key, so the pages of a document have consecutive ordinals.
+
+    Layout of output_dir:
+    - meta.json       format name/version, counts, average document length
+                      and dtypes
+    - terms.txt       vocabulary, one term per line (row order)
+    - documents.json  page table (column order)
+    - *.npy           one file per entry of ARRAY_DTYPES
+    Every file is renamed into place once all are written, meta.json last,
+    so a half-written index is never opened. meta.json holds a build_id that
+    changes with every build (see SparseIndex.version).
+    """
+    if index is None:
+        old_terms, old_documents = [], []
+        old_rows = old_cols = old_counts = np.empty(0, dtype=np.int64)
+    else:
+        old_terms, old_documents = index.terms, index.documents
+        old_rows = np.repeat(np.arange(index.num_terms), np.diff(index.indptr))
+        old_cols = np.array(index.indices, dtype=np.int64)
+        old_counts = np.array(index.counts, dtype=np.int64)
+
+    dropped = set(removed_document_ids) | set(documents)
+    locations = {
+        (document["document_id"], document["page"]): document["document_location"]
+        for document in old_documents
+        if document["document_id"] not in dropped
+    }
+    locations.update(
+        ((document_id, page), documents[document_id])
+        for document_id, page in term_counts
+    )
+    pages = sorted(locations)
+    columns = {page: col for col, page in enumerate(pages)}
+
+    # old column -> new column, -1 for the pages of dropped documents
+    col_map = np.array(
+        [
+            (
+                -1
+                if document["document_id"] in dropped
+                else columns[document["document_id"], document["page"]]
+            )
+            for document in old_documents
+        ],
+        dtype=np.int64,
+    )
+    kept = col_map[old_cols] >= 0
+    old_rows, old_cols, old_counts = old_rows[kept], old_cols[kept], old_counts[kept]
+
+    # terms that only occurred in dropped pages leave the vocabulary
+    kept_terms = {old_terms[term_id] for term_id in np.unique(old_rows)}
+    terms = sorted(
+        kept_terms.union(*(page_counts.keys() for page_counts in term_counts.values()))
+    )
+    term_ids = {term: term_id for term_id, term in enumerate(terms)}
+    row_map = np.array([term_ids.get(term, -1) for term in old_terms], dtype=np.int64)
+
+    new_rows, new_cols, new_counts = [], [], []
+    for page, page_counts in term_counts.items():
+        for term, count in page_counts.items():
+            new_rows.append(term_ids[term])
+            new_cols.append(columns[page])
+            new_counts.append(count)
+
+    rows = np.concatenate((row_map[old_rows], np.asarray(new_rows, dtype=np.int64)))
+    cols = np.concatenate((col_map[old_cols], np.asarray(new_cols, dtype=np.int64)))
+    counts = np.concatenate((old_counts, np.asarray(new_counts, dtype=np.int64)))
+
+    N = len(pages)
+    df = np.bincount(rows, minlength=len(terms))
+    idf = log_idf(N, df)
+    doc_lengths = np.bincount(cols, weights=counts, minlength=N)
+    vals = tf_idf_weights(counts, doc_lengths[cols], idf[rows])
+
+    _save_triplets(
+        rows,
+        cols,
+        vals,
+        counts,
+        terms,
+        idf,
+        [
+            {
+                "document_id": document_id,
+                "page": page,
+                "document_location": locations[document_id, page],
+            }
+            for document_id, page in pages
+        ],
+        output_dir,
+    )
+
+
+def _save_triplets(rows, cols, vals, counts, terms, idf, documents, output_dir):
+    """
+    Writes the postings given as (term id, page ordinal, weight, count)
+    arrays; documents is the page table in ordinal order.
+
+    Every file is written next to the one it replaces and renamed over it,
+    meta.json last, so processes that have the old index memory-mapped keep
+    a valid view and a half-written index is never opened.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    # postings of a term are sorted by document ordinal
+    order = np.lexsort((cols, rows))
+    rows, cols, vals, counts = rows[order], cols[order], vals[order], counts[order]
+
+    df = np.bincount(rows, minlength=len(terms))
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(df, out=indptr[1:])
+    doc_norms = np.sqrt(np.bincount(cols, weights=vals**2, minlength=len(documents)))
+    doc_lengths = np.bincount(cols, weights=counts, minlength=len(documents))
+
+    arrays = {
+        "indptr": indptr,
+        "indices": cols,
+        "data": vals,
+        "counts": counts,
+        "doc_norms": doc_norms,
+        "df": df,
+        "idf": idf,
+        "doc_lengths": doc_lengths,
+    }
+    temp_paths = []
+
+    def create(file_name, mode="wb"):
+        path = os.path.join(output_dir, file_name + ".tmp")
+        temp_paths.append(path)
+        return open(path, mode, encoding=None if "b" in mode else "utf-8")
+
+    for name, dtype in ARRAY_DTYPES.items():
+        with create(f"{name}.npy") as file:
+            np.save(file, arrays[name].astype(dtype))
+
+    with create(TERMS_FILE, "w") as file:
+        file.write("\n".join(terms))
+
+    with create(DOCUMENTS_FILE, "w") as file:
+        json.dump(documents, file, ensure_ascii=False)
+
+    meta = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "num_terms": len(terms),
+        "num_docs": len(documents),
+        "nnz": len(vals),
+        "avg_doc_length": float(doc_lengths.mean()) if len(doc_lengths) else 0.0,
+        "arrays": {name: np.dtype(dtype).str for name, dtype in ARRAY_DTYPES.items()},
+        "build_id": uuid.uuid4().hex,
+    }
+    with create(META_FILE, "w") as file:
+        json.dump(meta, file, indent=4)
+
+    for temp_path in temp_paths:
+        os.replace(temp_path, temp_path[: -len(".tmp")])
+
+
+class SparseIndex:
+    """
+    Read-only view of an index written by update_sparse_index.
+    The numeric arrays are memory-mapped, so opening the index costs the same
+    no matter how large the corpus is; only touched pages are read from disk.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+
+        self._meta_stat = self._stat_meta()
+        with open(os.path.join(index_dir, META_FILE), "r", encoding="utf-8") as file:
+            self.meta = json.load(file)
+
+        if self.meta.get("format") != FORMAT_NAME:
+            raise ValueError(f"{index_dir} is not a {FORMAT_NAME} directory")
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported index version {self.meta.get('version')} "
+                f"(expected {FORMAT_VERSION}), rebuild the index"
+            )
+
+        for name in ARRAY_DTYPES:
+            array = np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+            setattr(self, name, array)
+
+        with open(os.path.join(index_dir, TERMS_FILE), "r", encoding="utf-8") as file:
+            self.terms = file.read().split("\n") if self.meta["num_terms"] else []
+        self.term_ids = {term: term_id for term_id, term in enumerate(self.terms)}
+
+        with open(
+            os.path.join(index_dir, DOCUMENTS_FILE), "r", encoding="utf-8"
+        ) as file:
+            self.documents = json.load(file)
+
+        # the pages of a document have consecutive ordinals: number the
+        # documents by their first page and map every page to its document
+        first_pages = [
+            ordinal
+            for ordinal, document in enumerate(self.documents)
+            if ordinal == 0
+            or document["document_id"] != self.documents[ordinal - 1]["document_id"]
+        ]
+        self.first_pages = np.array(first_pages, dtype=np.int64)
+        self.page_documents = np.repeat(
+            np.arange(len(first_pages)), np.diff(first_pages + [len(self.documents)])
+        )
+
+    def _stat_meta(self):
+        try:
+            stat = os.stat(os.path.join(self.index_dir, META_FILE))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def is_stale(self):
+        """True if the index in index_dir was rebuilt since this view was opened."""
+        return self._stat_meta() != self._meta_stat
+
+    @property
+    def version(self):
+        """Identifies the build of the index, e.g. in cache keys."""
+        return self.meta.get("build_id", self.index_dir)
+
+    @property
+    def num_terms(self):
+        return self.meta["num_terms"]
+
+    @property
+    def num_docs(self):
+        # the units of the index are pages
+        return self.meta["num_docs"]
+
+    @property
+    def num_documents(self):
+        return len(self.first_pages)
+
+    @property
+    def avg_doc_length(self):
+        return self.meta["avg_doc_length"]
+
+    def term_id(self, term):
+        """Row of term in the matrix, None if term is out of vocabulary."""
+        return self.term_ids.get(term)
+
+    def document_frequency(self, term_id):
+        return int(self.df[term_id])
+
+    def postings(self, term_id):
+        """(page ordinals, tf-idf weights) of the pages containing term."""
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def term_counts(self, term_id):
+        """Raw term counts, aligned with the page ordinals of postings."""
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.counts[start:end]
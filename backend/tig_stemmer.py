@@ -1,54 +1,113 @@
+from functools import lru_cache
+import os
+import sys
+
 from .helper_functions import *
 
 
+class AffixTrie:
+    """
+    Character trie over a list of affixes. matches(word) returns, in list
+    order, the positions of every affix word starts with, in a single walk
+    down the trie instead of one startswith per affix.
+    Suffixes are stored reversed and looked up with the reversed word.
+    """
+
+    def __init__(self, affixes):
+        self.root = {}
+        for i, affix in enumerate(affixes):
+            node = self.root
+            for char in affix:
+                node = node.setdefault(char, {})
+            # None marks the end of an affix and holds its list positions
+            node.setdefault(None, []).append(i)
+
+    def matches(self, word):
+        node = self.root
+        found = list(node.get(None, ()))
+        for char in word:
+            node = node.get(char)
+            if node is None:
+                break
+            found.extend(node.get(None, ()))
+        return sorted(found)
+
+
 class TigrinyaStemmer:
     """
     The corpus is assumed to have gone through morphological preprocessing.
+
+    The affixes are transliterated once, when the stemmer is built, and
+    compiled into a prefix trie and a reversed-suffix trie, so all the affixes
+    a word can lose are found in one walk. Stems are
+    memoized in a bounded LRU cache keyed on the (normalized) word; since
+    newspaper text is Zipfian most tokens are cache hits. cache_size=0 turns
+    the cache off.
     """
 
     # NOTE - never use replace method to remove prefix and suffix of any kind!!
 
     # vowels = ["ኧ", "ኡ", "ኢ", "ኣ", "ኤ", "እ", "ኦ"]
     vowels = ["e", "u", "i", "a", "E", "o"]
+    non_radicals = frozenset(vowels).union({"'", "W"})
 
-    def __init__(self, prefix_suffix_pairs, prefix_list, suffix_list):
+    def __init__(self, prefix_suffix_pairs, prefix_list, suffix_list, cache_size=2**16):
         self.prefix_suffix_pairs = prefix_suffix_pairs
         self.prefix_list = prefix_list
         self.suffix_list = suffix_list
 
+        # (transliterated affix, its number of radicals), in list order
+        self._pairs = [
+            (prefix, suffix, self.count_radicals(prefix + suffix))
+            for prefix, suffix in (
+                (transliterate(prefix), transliterate(suffix))
+                for prefix, suffix in prefix_suffix_pairs
+            )
+        ]
+        self._prefixes = self._affix_table(prefix_list)
+        self._suffixes = self._affix_table(suffix_list)
+        self._prefix_trie = AffixTrie(affix for affix, _ in self._prefixes)
+        self._suffix_trie = AffixTrie(affix[::-1] for affix, _ in self._suffixes)
+
+        self._cached_stem = lru_cache(maxsize=cache_size)(self._stem)
+
+    def _affix_table(self, affixes):
+        return [
+            (affix, self.count_radicals(affix)) for affix in map(transliterate, affixes)
+        ]
+
+    def cache_info(self):
+        """Hits, misses, maximum and current size of the stem cache."""
+        return self._cached_stem.cache_info()
+
+    def cache_clear(self):
+        self._cached_stem.cache_clear()
+
     def count_radicals(self, word=""):
         """Count the number of radicals (consonants) in a word."""
         return len(self.extract_root(word))
 
     def extract_root(self, word=""):
-        return "".join(
-            [char for char in word if char not in set(self.vowels).union({"'", "W"})]
-        )
+        return "".join([char for char in word if char not in self.non_radicals])
 
     def remove_prefix_suffix_pair(self, word=""):
         """
         Prefix-suffix pairs are usually used to derive nouns from verbs.
         """
         stemmed_word = transliterate(word)
-        prefix_suffix_pairs = [
-            (transliterate(pair[0]), transliterate(pair[1]))
-            for pair in self.prefix_suffix_pairs
-        ]
 
-        i = 0
-        while self.count_radicals(stemmed_word) > 3 and i < len(prefix_suffix_pairs):
-            prefix = prefix_suffix_pairs[i][0]
-            suffix = prefix_suffix_pairs[i][1]
+        word_radicals = self.count_radicals(word)
+        for prefix, suffix, pair_radicals in self._pairs:
+            if self.count_radicals(stemmed_word) <= 3:
+                break
             if (
                 stemmed_word.startswith(prefix)
                 and stemmed_word.endswith(suffix)
-                and self.count_radicals(word) - self.count_radicals(prefix + suffix)
-                >= 3
+                and word_radicals - pair_radicals >= 3
             ):
                 prefix_removed = stemmed_word[len(prefix) :]
                 suffix_removed = prefix_removed[: -len(suffix)]
                 stemmed_word = suffix_removed
-            i += 1
 
         try:
             return transcribe(stemmed_word)
@@ -66,18 +125,33 @@ class TigrinyaStemmer:
                 return stemmed_word[: i + 2] + stemmed_word[i + 4 :]
         return stemmed_word
 
-    def remove_prefix(self, word=""):
-        stemmed_word = transliterate(word)
-
-        prefix_list = [transliterate(prefix) for prefix in self.prefix_list]
+    def _remove_affixes(self, stemmed_word, affixes, matches, strip):
+        """
+        Same greedy order as walking the affix list with startswith/endswith:
+        the first affix in list order at or after the last one removed that
+        matches and leaves at least 3 radicals is removed, then the search
+        goes on from the next list position against the shortened word.
+        """
+        radicals = self.count_radicals(stemmed_word)
         i = 0
-        while self.count_radicals(stemmed_word) > 3 and i < len(prefix_list):
-            if stemmed_word.startswith(prefix_list[i]) and (
-                self.count_radicals(stemmed_word) - self.count_radicals(prefix_list[i])
-                >= 3
-            ):
-                stemmed_word = stemmed_word[len(prefix_list[i]) :]
-            i += 1
+        while radicals > 3:
+            for j in matches(stemmed_word):
+                if j >= i and radicals - affixes[j][1] >= 3:
+                    stemmed_word = strip(stemmed_word, affixes[j][0])
+                    radicals = self.count_radicals(stemmed_word)
+                    i = j + 1
+                    break
+            else:
+                break
+        return stemmed_word
+
+    def remove_prefix(self, word=""):
+        stemmed_word = self._remove_affixes(
+            transliterate(word),
+            self._prefixes,
+            self._prefix_trie.matches,
+            lambda stemmed_word, prefix: stemmed_word[len(prefix) :],
+        )
 
         try:
             return transcribe(stemmed_word)
@@ -86,17 +160,12 @@ class TigrinyaStemmer:
             return word
 
     def remove_suffix(self, word=""):
-        stemmed_word = transliterate(word)
-
-        suffix_list = [transliterate(suffix) for suffix in self.suffix_list]
-        i = 0
-        while self.count_radicals(stemmed_word) > 3 and i < len(suffix_list):
-            if stemmed_word.endswith(suffix_list[i]) and (
-                self.count_radicals(stemmed_word) - self.count_radicals(suffix_list[i])
-                >= 3
-            ):
-                stemmed_word = stemmed_word[: -len(suffix_list[i])]
-            i += 1
+        stemmed_word = self._remove_affixes(
+            transliterate(word),
+            self._suffixes,
+            lambda stemmed_word: self._suffix_trie.matches(stemmed_word[::-1]),
+            lambda stemmed_word, suffix: stemmed_word[: -len(suffix)],
+        )
 
         try:
             return transcribe(stemmed_word)
@@ -122,7 +191,9 @@ class TigrinyaStemmer:
         For simplicity implementation is done assuming the method gets called passing a word.
         In practice, stem method should run on corpus.
         """
+        return self._cached_stem(word)
 
+    def _stem(self, word):
         stemmed_word = word
 
         stemmed_word0 = self.remove_prefix_suffix_pair(stemmed_word)
@@ -134,41 +205,104 @@ class TigrinyaStemmer:
         return stemmed_word4
 
 
-def main():
-    prefix_suffix_pairs = [("መ", "ቲ"), ("መ", "ያ"), ("መ", "ኢ"), ("መ", "ታ"), ("መ", "ት")]
-    prefix_list = load_txt_file("lists/prefix_list.txt")
-    suffix_list = load_txt_file("lists/suffix_list.txt")
-
-    stemmer = TigrinyaStemmer(prefix_suffix_pairs, prefix_list, suffix_list)
-    preprocessor = TigMorphPreprocess()
-
-    # ps_words = ["መቅበሪ", "መንግስቲ", "መወርወሪ", "መድሓኒት", "መጀመርታ"]
-    # dlp_words = ["ገልጠምጠም"]
-    # p_words = ["ንሰላም"]
-    # s_words = ["ማዕከላት"]
-    # dlp_words2 = ["ሰባቢሩ", "ቆራሪጹ"]
-    # for word in dlp_words2:
-    #     preprocessed_word0 = preprocessor.normalize(word)
-    #     preprocessed_word1 = preprocessor.remove_stopwords(preprocessed_word0)
-    #     if preprocessed_word1 == "":
-    #         print(
-    #             f"The word you provided ({word}) was removed during the preprocessing stage!"
-    #         )
-    #     else:
-    #         stemmed_word = stemmer.stem(preprocessed_word)
-    #         print(f"{word} --> {stemmed_word}")
+class SequentialTigrinyaStemmer(TigrinyaStemmer):
+    """
+    Reference stemmer with the original linear scans of the affix lists,
+    kept to check the trie-based TigrinyaStemmer against.
+    """
 
-    word = "ቆራሪጹ"
-    preprocessed_word0 = preprocessor.normalize(word)
-    preprocessed_word1 = preprocessor.remove_stopwords(preprocessed_word0)
-    if preprocessed_word1 == "":
-        print(
-            f"The word you provided ({word}) was removed during the preprocessing stage!"
-        )
+    def remove_prefix(self, word=""):
+        stemmed_word = transliterate(word)
+
+        prefix_list = [transliterate(prefix) for prefix in self.prefix_list]
+        i = 0
+        while self.count_radicals(stemmed_word) > 3 and i < len(prefix_list):
+            if stemmed_word.startswith(prefix_list[i]) and (
+                self.count_radicals(stemmed_word) - self.count_radicals(prefix_list[i])
+                >= 3
+            ):
+                stemmed_word = stemmed_word[len(prefix_list[i]) :]
+            i += 1
+
+        try:
+            return transcribe(stemmed_word)
+        except:
+            print(f"Word: {word}\nStemmed Word: {stemmed_word}\b")
+            return word
+
+    def remove_suffix(self, word=""):
+        stemmed_word = transliterate(word)
+
+        suffix_list = [transliterate(suffix) for suffix in self.suffix_list]
+        i = 0
+        while self.count_radicals(stemmed_word) > 3 and i < len(suffix_list):
+            if stemmed_word.endswith(suffix_list[i]) and (
+                self.count_radicals(stemmed_word) - self.count_radicals(suffix_list[i])
+                >= 3
+            ):
+                stemmed_word = stemmed_word[: -len(suffix_list[i])]
+            i += 1
+
+        try:
+            return transcribe(stemmed_word)
+        except:
+            print(f"Word: {word}\nStemmed Word: {stemmed_word}\b")
+            return word
+
+
+def corpus_vocabulary(source_folder="tig_corpus (txt)"):
+    """
+    Every distinct token that reaches the stemmer, from the text corpus if it
+    is there and from the sample corpus otherwise.
+    """
+    from .preprocessing import SAMPLE_CORPUS, TigMorphPreprocess
+
+    if os.path.isdir(source_folder):
+        texts = []
+        for file_name in sorted(os.listdir(source_folder)):
+            if file_name.endswith(".txt"):
+                with open(
+                    os.path.join(source_folder, file_name), "r", encoding="utf-8"
+                ) as file:
+                    texts.append(file.read().replace("\n", " "))
     else:
-        stemmed_word = stemmer.stem(preprocessed_word)
-        print(f"{word} --> {stemmed_word}")
+        texts = [SAMPLE_CORPUS]
+
+    vocabulary = set()
+    for text in texts:
+        psr = TigMorphPreprocess(text)
+        vocabulary.update(
+            psr.tokenize().normalize().remove_stopwords().get_result().split()
+        )
+    return sorted(vocabulary)
+
+
+# NOTE - testing my methods
+def main(source_folder="tig_corpus (txt)"):
+    from .resources import get_resources
+
+    resources = get_resources()
+    args = (
+        resources.prefix_suffix_pairs,
+        resources.prefix_list,
+        resources.suffix_list,
+    )
+    stemmer = TigrinyaStemmer(*args, cache_size=0)
+    reference = SequentialTigrinyaStemmer(*args, cache_size=0)
+
+    vocabulary = corpus_vocabulary(source_folder)
+    mismatches = [
+        (word, reference.stem(word), stemmer.stem(word))
+        for word in vocabulary
+        if reference.stem(word) != stemmer.stem(word)
+    ]
+    for word, expected, found in mismatches[:20]:
+        print(f"Error: {word} --> {found} (expected {expected})")
+    print(f"{len(vocabulary)} words stemmed, {len(mismatches)} mismatches")
+
+    word = "ቆራሪጹ"
+    print(f"{word} --> {stemmer.stem(word)}")
 
 
 if __name__ == "__main__":
-    main()
+    main(*sys.argv[1:2])
@@ -0,0 +1,431 @@
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+from datetime import date, timedelta
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from backend.helper_functions import normalize, transliteration_table
+from backend.resources import get_resources
+from backend.search_engine import RANKING_MODES, SearchEngine
+from build_inverted_index import update_inverted_index
+from create_term_doc_matrix import update_tf_idf_index
+from txt2json import convert_folder
+
+# Number of documents of the corpora, an issue of Haddas Ertra is a document
+CORPUS_SIZES = (25, 100, 400)
+
+# Characters per word of the synthetic vocabulary, and how common each is
+WORD_LENGTHS = (2, 3, 4, 5, 6)
+WORD_LENGTH_WEIGHTS = (0.15, 0.3, 0.3, 0.15, 0.1)
+
+# Terms per query, and how common each is
+QUERY_LENGTHS = (1, 2, 3, 4)
+QUERY_LENGTH_WEIGHTS = (0.3, 0.35, 0.2, 0.15)
+
+# Metrics compared by compare_results, and whether more is better
+METRICS = {
+    "build_seconds": False,
+    "index_mb": False,
+    "build_peak_rss_mb": False,
+    "cold_p50_ms": False,
+    "cold_p99_ms": False,
+    "warm_p50_ms": False,
+    "warm_p95_ms": False,
+    "warm_p99_ms": False,
+    "qps": True,
+    "log_qps": True,
+    "batch_qps": True,
+    "peak_rss_mb": False,
+}
+
+
+def zipf_weights(n, s=1.0):
+    """Probabilities of the ranks 1 to n of a Zipf distribution of exponent s."""
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+def stems_cleanly(word, stemmer):
+    # the stemmer prints the words whose stem it cannot spell back in
+    # Ethiopic (some spellings are ambiguous in SERA)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        stemmer.stem(normalize(word))
+    return not output.getvalue()
+
+
+def synthetic_vocabulary(num_words, seed=0):
+    """
+    num_words distinct words of letters of the SERA table, most frequent
+    first. The stopwords are spread over the first ranks, every other word,
+    as in running text; the other words are random.
+    """
+    rng = random.Random(seed)
+    # the labialized letters (SERA "W") are rare in running text
+    letters = sorted(
+        letter for letter, sera in transliteration_table.items() if "W" not in sera
+    )
+    resources = get_resources()
+    stopwords = sorted(resources.stopwords)
+
+    words = []
+    seen = set(stopwords)
+    while len(words) < num_words:
+        if len(words) % 2 == 0 and len(words) // 2 < len(stopwords):
+            words.append(stopwords[len(words) // 2])
+            continue
+        length = rng.choices(WORD_LENGTHS, WORD_LENGTH_WEIGHTS)[0]
+        word = "".join(rng.choices(letters, k=length))
+        if word not in seen and stems_cleanly(word, resources.stemmer):
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def generate_corpus(
+    folder,
+    num_documents,
+    vocabulary,
+    zipf_s=1.0,
+    pages=(6, 12),
+    tokens_per_page=(300, 900),
+    seed=0,
+):
+    """
+    Writes num_documents text files to folder, like pdf2txt.py does: one per
+    issue, named after its date, its pages separated by form feeds. Every
+    page has a random number of words (tokens_per_page, inclusive) drawn from
+    vocabulary with Zipfian frequencies, in sentences ending with "።".
+    The first documents are the same whatever num_documents is.
+    Returns (number of pages, number of words).
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    weights = zipf_weights(len(vocabulary), zipf_s)
+    num_pages = num_words = 0
+
+    for i in range(num_documents):
+        issue_date = date(2000, 1, 1) + timedelta(days=i)
+        file_path = os.path.join(
+            folder, f"haddas_eritra_{issue_date.strftime('%d%m%Y')}.txt"
+        )
+        with open(file_path, "w", encoding="utf-8") as file:
+            for _ in range(rng.integers(pages[0], pages[1] + 1)):
+                length = rng.integers(tokens_per_page[0], tokens_per_page[1] + 1)
+                words = [
+                    vocabulary[j]
+                    for j in rng.choice(len(vocabulary), length, p=weights)
+                ]
+                sentences = [
+                    " ".join(words[start : start + 12]) + "።"
+                    for start in range(0, length, 12)
+                ]
+                file.write("\n".join(sentences) + "\n\f")
+                num_pages += 1
+                num_words += int(length)
+
+    return num_pages, num_words
+
+
+def generate_query_log(vocabulary, num_queries, num_distinct, zipf_s=1.0, seed=0):
+    """
+    num_queries queries, drawn with Zipfian frequencies from num_distinct
+    distinct ones, so that popular queries repeat as in a real query log.
+    Query terms are words of vocabulary other than stopwords, drawn with
+    Zipfian frequencies as well.
+    """
+    rng = np.random.default_rng(seed)
+    stopwords = get_resources().stopwords
+    terms = [word for word in vocabulary if word not in stopwords]
+    weights = zipf_weights(len(terms), zipf_s)
+
+    distinct = []
+    for _ in range(num_distinct):
+        length = rng.choice(QUERY_LENGTHS, p=QUERY_LENGTH_WEIGHTS)
+        distinct.append(
+            " ".join(terms[j] for j in rng.choice(len(terms), length, p=weights))
+        )
+
+    picks = rng.choice(num_distinct, num_queries, p=zipf_weights(num_distinct, zipf_s))
+    return [distinct[j] for j in picks]
+
+
+def folder_size(folder):
+    return sum(
+        os.path.getsize(os.path.join(folder, file_name))
+        for file_name in os.listdir(folder)
+    )
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def drop_page_cache(folder):
+    """
+    Evicts the files of folder from the page cache, so that they are read
+    from disk again. Written pages are only evicted once they reach the disk.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    os.sync()
+    for file_name in os.listdir(folder):
+        fd = os.open(os.path.join(folder, file_name), os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def build_indexes(work_dir, num_documents, vocabulary, seed=0, workers=None):
+    """
+    Generates a corpus of num_documents documents in work_dir and runs the
+    pipeline on it, from the text files to the TF-IDF index (tig_index) and
+    the inverted index, timing every stage.
+    Meant to run in a process of its own, for its peak RSS.
+    """
+    txt_folder = os.path.join(work_dir, "tig_corpus (txt)")
+    json_folder = os.path.join(work_dir, "tig_corpus (json)")
+    tf_idf_dir = os.path.join(work_dir, "tig_index")
+    inverted_dir = os.path.join(work_dir, "inverted_index")
+
+    start = time.perf_counter()
+    num_pages, num_words = generate_corpus(
+        txt_folder, num_documents, vocabulary, seed=seed
+    )
+    generate_seconds = time.perf_counter() - start
+
+    _, num_tokens, preprocess_seconds = convert_folder(
+        txt_folder, json_folder, "tig_corpus (pdf)", workers, full=True
+    )
+
+    start = time.perf_counter()
+    update_tf_idf_index(json_folder, tf_idf_dir, full=True)
+    tf_idf_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    update_inverted_index(json_folder, inverted_dir, full=True)
+    inverted_seconds = time.perf_counter() - start
+
+    return {
+        "documents": num_documents,
+        "pages": num_pages,
+        "words": num_words,
+        "tokens": num_tokens,
+        "generate_seconds": generate_seconds,
+        "preprocess_seconds": preprocess_seconds,
+        "tf_idf_seconds": tf_idf_seconds,
+        "inverted_seconds": inverted_seconds,
+        "build_seconds": preprocess_seconds + tf_idf_seconds + inverted_seconds,
+        "tf_idf_mb": folder_size(tf_idf_dir) / 2**20,
+        "inverted_mb": folder_size(inverted_dir) / 2**20,
+        "index_mb": (folder_size(tf_idf_dir) + folder_size(inverted_dir)) / 2**20,
+        # the preprocessing runs in worker processes
+        "build_peak_rss_mb": max(peak_rss_mb(), peak_rss_mb(resource.RUSAGE_CHILDREN)),
+    }
+
+
+def latencies(search, queries, **options):
+    """Seconds taken by search(query, **options) for each of queries."""
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query, **options)
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def measure_queries(index_dir, query_log, ranking, repeat=3, batch_size=100):
+    """
+    Query latency and throughput of the index in index_dir, with ranking.
+    Meant to run in a fresh process, for cold starts and its peak RSS.
+
+    cold: the distinct queries of query_log, in a process that just opened
+          the index, after it was evicted from the page cache
+    warm: the same queries again, without the result cache, the fastest
+          of repeat runs of each
+    qps: queries per second of the warm latencies
+    log_qps: queries per second of query_log as it comes, the repeated
+             queries served from the result cache
+    batch_qps: queries per second of the distinct queries sent to
+               search_batch batch_size at a time, without the result cache
+    """
+    drop_page_cache(index_dir)
+    start = time.perf_counter()
+    engine = SearchEngine(index_dir)
+    load_seconds = time.perf_counter() - start
+
+    queries = list(dict.fromkeys(query_log))
+    cold = latencies(engine.search, queries, ranking=ranking)
+    runs = []
+    for _ in range(repeat):
+        engine.cache.clear()
+        runs.append(latencies(engine.search, queries, ranking=ranking))
+    warm = np.min(runs, axis=0)
+
+    engine.cache.clear()
+    hits, misses = engine.cache.hits, engine.cache.misses
+    log_seconds = latencies(engine.search, query_log, ranking=ranking).sum()
+    hits, misses = engine.cache.hits - hits, engine.cache.misses - misses
+
+    engine.cache.clear()
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        engine.search_batch(queries[i : i + batch_size], ranking=ranking)
+    batch_seconds = time.perf_counter() - start
+
+    cold_ms = np.percentile(cold, (50, 95, 99)) * 1000
+    warm_ms = np.percentile(warm, (50, 95, 99)) * 1000
+    return {
+        "ranking": ranking,
+        "queries": len(queries),
+        "load_seconds": load_seconds,
+        "cold_p50_ms": cold_ms[0],
+        "cold_p95_ms": cold_ms[1],
+        "cold_p99_ms": cold_ms[2],
+        "cold_max_ms": cold.max() * 1000,
+        "warm_p50_ms": warm_ms[0],
+        "warm_p95_ms": warm_ms[1],
+        "warm_p99_ms": warm_ms[2],
+        "qps": len(queries) / warm.sum(),
+        "log_qps": len(query_log) / log_seconds,
+        "log_hit_rate": hits / (hits + misses),
+        "batch_qps": len(queries) / batch_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def in_new_process(function, *args, **kwargs):
+    # a fresh interpreter, so that every measurement has its own peak RSS and
+    # starts cold
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(function, *args, **kwargs).result()
+
+
+def run_benchmark(
+    work_dir,
+    sizes=CORPUS_SIZES,
+    vocabulary_size=50_000,
+    num_queries=2000,
+    num_distinct=500,
+    seed=0,
+    workers=None,
+):
+    """
+    Builds a synthetic corpus of each of sizes (number of documents) in
+    work_dir and measures the indexes built from it (see build_indexes)
+    and the queries of a synthetic query log against them in every ranking
+    mode (see measure_queries). Everything is derived from seed, so runs
+    with the same arguments measure the same work.
+    Returns one dict per corpus size and ranking mode.
+    """
+    vocabulary = synthetic_vocabulary(vocabulary_size, seed)
+    query_log = generate_query_log(vocabulary, num_queries, num_distinct, seed=seed)
+
+    results = []
+    for num_documents in sizes:
+        corpus_dir = os.path.join(work_dir, f"{num_documents}_documents")
+        build = in_new_process(
+            build_indexes, corpus_dir, num_documents, vocabulary, seed, workers
+        )
+        for ranking in RANKING_MODES:
+            queries = in_new_process(
+                measure_queries,
+                os.path.join(corpus_dir, "tig_index"),
+                query_log,
+                ranking,
+            )
+            results.append({**build, **queries})
+    return results
+
+
+def print_results(results):
+    print(
+        "documents    pages   tokens  build s  index MB  build RSS MB  ranking  "
+        "cold p50/p99 ms  warm p50/p95/p99 ms      qps  log qps  batch qps  RSS MB"
+    )
+    for result in results:
+        print(
+            f"{result['documents']:9d}  {result['pages']:7d}  {result['tokens']:7d}  "
+            f"{result['build_seconds']:7.2f}  {result['index_mb']:8.2f}  "
+            f"{result['build_peak_rss_mb']:12.1f}  {result['ranking']:>7}  "
+            f"{result['cold_p50_ms']:7.2f}/{result['cold_p99_ms']:<7.2f}  "
+            f"{result['warm_p50_ms']:6.2f}/{result['warm_p95_ms']:5.2f}/"
+            f"{result['warm_p99_ms']:<6.2f}  {result['qps']:7.0f}  "
+            f"{result['log_qps']:7.0f}  {result['batch_qps']:9.0f}  "
+            f"{result['peak_rss_mb']:6.1f}"
+        )
+
+
+def compare_results(baseline, results, tolerance=0.25):
+    """
+    Prints the metrics of results that are worse than in baseline (results
+    of an earlier run) by more than tolerance, for the corpus sizes and
+    ranking modes of both. Returns the number of such regressions.
+    """
+    baseline = {(result["documents"], result["ranking"]): result for result in baseline}
+    regressions = 0
+    for result in results:
+        previous = baseline.get((result["documents"], result["ranking"]))
+        if previous is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if not previous.get(metric):
+                continue
+            change = result[metric] / previous[metric] - 1
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions += 1
+                print(
+                    f"Regression: {result['documents']} documents, "
+                    f"{result['ranking']}: {metric} {previous[metric]:.2f} -> "
+                    f"{result[metric]:.2f} ({change:+.0%})"
+                )
+    print(f"{regressions} regressions (tolerance {tolerance:.0%})")
+    return regressions
+
+
+# NOTE - benchmarking the pipeline and the search engine
+def main(sizes=CORPUS_SIZES, json_path=None, baseline_path=None, tolerance=0.25):
+    with tempfile.TemporaryDirectory(prefix="tig_benchmark_") as work_dir:
+        results = run_benchmark(work_dir, sizes)
+    print_results(results)
+
+    if json_path:
+        with open(json_path, "w") as file:
+            json.dump(results, file, indent=4)
+    if baseline_path:
+        with open(baseline_path, "r") as file:
+            baseline = json.load(file)
+        return compare_results(baseline, results, tolerance)
+    return 0
+
+
+if __name__ == "__main__":
+    # usage: python benchmark.py [documents ...] [--json results.json]
+    #                            [--compare baseline.json] [--tolerance 0.25]
+    args = sys.argv[1:]
+    options = {}
+    for option in ("--json", "--compare", "--tolerance"):
+        if option in args:
+            i = args.index(option)
+            options[option] = args[i + 1]
+            del args[i : i + 2]
+
+    regressions = main(
+        tuple(map(int, args)) or CORPUS_SIZES,
+        options.get("--json"),
+        options.get("--compare"),
+        float(options.get("--tolerance", 0.25)),
+    )
+    sys.exit(1 if regressions else 0)
@@ -1,43 +1,156 @@
 import os
+import sys
 import json
 from collections import defaultdict
 
+from backend.helper_functions import document_pages
+from backend.inverted_index import (
+    META_FILE,
+    InvertedIndex,
+    merge_inverted_index,
+    save_inverted_index,
+)
+from backend.manifest import Manifest
+
+
+def add_document(inverted_index, documents, data):
+    """
+    Appends the postings of the pages of one JSON document, each page with
+    the next ordinal. Positions are counted from the start of the page.
+    """
+    for page, tokens in document_pages(data):
+        doc_ordinal = len(documents)
+        documents.append(
+            {
+                "document_id": data["document_id"],
+                "page": page,
+                "document_location": data["document_location"],
+                "length": len(tokens),
+            }
+        )
+
+        # Collect the positions of every distinct token in one pass...
+        token_positions = defaultdict(list)
+        for position, token in enumerate(tokens):
+            token_positions[token].append(position)
+
+        # ...and append one posting per distinct token of the page
+        for token, positions in token_positions.items():
+            inverted_index[token].append((doc_ordinal, positions))
+
 
 def build_inverted_index(source_folder):
     inverted_index = defaultdict(list)
+    documents = []
 
-    # Iterate over all files in the folder
-    for filename in os.listdir(source_folder):
+    # Iterate over all files in the folder, in a fixed order so that
+    # document ordinals (and therefore posting lists) come out sorted
+    for filename in sorted(os.listdir(source_folder)):
         if filename.endswith(".json"):
             file_path = os.path.join(source_folder, filename)
 
             # Open and read the JSON file
             with open(file_path, "r", encoding="utf-8") as file:
                 data = json.load(file)
-                document_id = data["document_id"]
-                tokens = data["tokens"]
 
-                # Build the inverted index
-                for token in tokens:
-                    if document_id not in inverted_index[token]:
-                        inverted_index[token].append(document_id)
+            add_document(inverted_index, documents, data)
+
+    return inverted_index, documents
+
+
+def remaining_documents(index, removed_document_ids):
+    """
+    The pages of an InvertedIndex without those of removed_document_ids,
+    in their order, and the ordinals of the removed pages.
+    """
+    removed_document_ids = set(removed_document_ids)
+    documents, removed = [], []
+    for doc_ordinal, document in enumerate(index.documents):
+        if document["document_id"] in removed_document_ids:
+            removed.append(doc_ordinal)
+        else:
+            documents.append(document)
+    return documents, removed
 
-    return inverted_index
 
+def update_inverted_index(source_folder, output_dir, with_positions=True, full=False):
+    """
+    Brings the index in output_dir up to date with the JSON documents of
+    source_folder. Only documents that are new or changed since the last run
+    (according to the manifest kept in output_dir) are read and tokenized,
+    and merged into the index (see merge_inverted_index): the posting lists
+    of the others are copied as they are encoded, as far as the pages of the
+    changed documents allow.
+    Builds the index from scratch if there is none yet or full is set; an
+    existing index keeps its with_positions setting.
+    Returns (number of documents read, number of documents removed).
+    """
+    manifest = Manifest(output_dir)
+    index = None
+    if full or not os.path.exists(os.path.join(output_dir, META_FILE)):
+        manifest.entries = {}
+    else:
+        index = InvertedIndex(output_dir)
 
-def save_inverted_index(inverted_index, output_file):
-    with open(output_file, "w", encoding="utf-8") as file:
-        json.dump(inverted_index, file, ensure_ascii=False, indent=4)
+    file_names = sorted(
+        filename for filename in os.listdir(source_folder) if filename.endswith(".json")
+    )
+    changed, removed, fingerprints = manifest.changes(source_folder, file_names)
+    if index is not None and not changed and not removed:
+        return 0, 0
+
+    if index is None:
+        documents, removed_pages = [], []
+    else:
+        # the previous versions of changed documents are replaced
+        documents, removed_pages = remaining_documents(
+            index,
+            [
+                manifest.entries[filename]["document_id"]
+                for filename in changed + removed
+                if filename in manifest.entries
+            ],
+        )
+
+    # postings of the new pages only, numbered after the remaining ones
+    inverted_index = defaultdict(list)
+    for filename in changed:
+        file_path = os.path.join(source_folder, filename)
+        with open(file_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+
+        add_document(inverted_index, documents, data)
+        manifest.record(
+            filename, fingerprints[filename], document_id=data["document_id"]
+        )
+
+    if index is None:
+        save_inverted_index(inverted_index, documents, output_dir, with_positions)
+    else:
+        merge_inverted_index(
+            index, removed_pages, inverted_index, documents, output_dir
+        )
+        del index
+
+    for filename in removed:
+        manifest.forget(filename)
+    manifest.save()
+
+    return len(changed), len(removed)
 
 
 if __name__ == "__main__":
     source_folder = "tig_corpus (json)"
-    output_file = "inverted_index.json"
-
-    # Build the inverted index
-    inverted_index = build_inverted_index(source_folder)
+    output_dir = "inverted_index"
+    with_positions = True
 
-    # Save the inverted index to a file
-    save_inverted_index(inverted_index, output_file)
+    # Update the inverted index on disk with the new and changed documents,
+    # or build it (python build_inverted_index.py --full)
+    num_read, num_removed = update_inverted_index(
+        source_folder, output_dir, with_positions, full="--full" in sys.argv
+    )
 
-    print(f"Inverted index saved to {output_file}")
\ No newline at end of file
+    print(
+        f"Inverted index saved to {output_dir} "
+        f"({num_read} documents read, {num_removed} removed)"
+    )
@@ -1,73 +1,328 @@
-from selenium import webdriver
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
+import sys
+import threading
 import time
+
+from bs4 import BeautifulSoup
 import requests
-import os
+from requests.adapters import HTTPAdapter
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
+
+from backend.manifest import Manifest, file_hash
 
 # Base URL and page range
 base_url = "https://shabait.com/category/newspapers/haddas-ertra-news/page/"
 start_page = 15
 end_page = 41
 target_year = "2023"
-links = []
-
 
 links_file = "newspaper_links_2023.txt"
+save_directory = "tig_corpus"
 
+# Where the PDF of every issue is served from
+pdf_base_url = "http://50.7.16.234/hadas-eritrea/"
+
+# Links to the newspapers on a listing page
+POST_LINK_SELECTOR = "a.post-title.post-url"
+
+
+class IncompleteDownload(Exception):
+    pass
+
+
+# failures after which a download is resumed rather than given up on
+RETRIABLE_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    IncompleteDownload,
+)
+
+
+def scrape_links(base_url, start_page, end_page, target_year, timeout=30):
+    """
+    Links to the newspapers of target_year on the listing pages
+    start_page to end_page of base_url.
+    """
+    links = []
 
-if os.path.exists(links_file) and os.path.getsize(links_file) > 0:
-    print("Loading links from file...")
-    with open(links_file, "r") as file:
-        links = file.read().splitlines()
-else:
-    print("Scraping website for links...")
     # Initialize the Selenium WebDriver (assuming you have ChromeDriver installed)
     driver = webdriver.Chrome()
+    try:
+        # Loop through the specified range of pages
+        for page in range(start_page, end_page + 1):
+            url = f"{base_url}{page}/"
+            driver.get(url)
+            # Wait for JavaScript to render the links, and no longer
+            WebDriverWait(driver, timeout).until(
+                expected_conditions.presence_of_element_located(
+                    (By.CSS_SELECTOR, POST_LINK_SELECTOR)
+                )
+            )
 
-    # Loop through the specified range of pages
-    for page in range(start_page, end_page + 1):
-        url = f"{base_url}{page}/"
-        driver.get(url)
-        time.sleep(3)  # Wait for JavaScript to load the content
+            soup = BeautifulSoup(driver.page_source, "html.parser")
+            # Find all links that match the pattern
+            for a_tag in soup.select(POST_LINK_SELECTOR):
+                href = a_tag.get("href")
+                if target_year in href:
+                    links.append(href)
+    finally:
+        # Close the WebDriver
+        driver.quit()
 
-        soup = BeautifulSoup(driver.page_source, "html.parser")
-        # Find all links that match the pattern
-        for a_tag in soup.find_all("a", class_="post-title post-url"):
-            href = a_tag.get("href")
-            if target_year in href:
-                links.append(href)
+    return links
 
-    # Close the WebDriver
-    driver.quit()
 
+def load_links(links_file):
+    """The links saved in links_file, scraped and saved first if there are none."""
+    if os.path.exists(links_file) and os.path.getsize(links_file) > 0:
+        print("Loading links from file...")
+        with open(links_file, "r") as file:
+            return file.read().splitlines()
 
+    print("Scraping website for links...")
+    links = scrape_links(base_url, start_page, end_page, target_year)
     with open(links_file, "w") as file:
         for link in links:
             file.write(link + "\n")
+    return links
 
 
-save_directory = "tig_corpus"
+def pdf_filename(link):
+    # Extract the date from the link to construct the PDF file name
+    # (e.g. haddas_eritra_29122023.pdf)
+    date_part = link.split("/")[5:2:-1]
+    date_str = "".join(date_part)
+    return f"haddas_eritra_{date_str}.pdf"
 
 
-os.makedirs(save_directory, exist_ok=True)
+def make_session(workers):
+    """
+    A session whose connection pool holds one connection per worker, so that
+    every download reuses an open connection instead of opening its own.
+    """
+    session = requests.Session()
+    # byte ranges only make sense on the file itself, not a compressed copy
+    session.headers["Accept-Encoding"] = "identity"
+    adapter = HTTPAdapter(pool_maxsize=workers, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-# Extract and download PDFs
-for link in links:
-    # Extract the date from the link to construct the PDF URL
-    date_part = link.split("/")[5:2:-1]
-    date_str = "".join(date_part)
-    
-    # Construct the PDF URL (e.g., http://50.7.16.234/hadas-eritrea/haddas_eritra_29122023.pdf)
-    pdf_url = f"http://50.7.16.234/hadas-eritrea/haddas_eritra_{date_str}.pdf"
-
-    # Send a GET request to download the PDF
-    response = requests.get(pdf_url)
-    
-    # Define the file name based on the URL
-    pdf_filename = f"haddas_eritra_{date_str}.pdf"
-    
-    # Save the PDF to the specified directory
-    with open(os.path.join(save_directory, pdf_filename), "wb") as pdf_file:
-        pdf_file.write(response.content)
-    
-    print(f"Downloaded: {pdf_filename}")
+
+def if_range_validator(entry):
+    # If-Range only accepts a strong ETag or a date
+    etag = entry.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return entry.get("last_modified")
+
+
+def fetch(session, url, path, entry, started, chunk_size=2**16, timeout=(10, 60)):
+    """
+    Downloads url to path through path + ".part".
+
+    entry is the manifest entry of path. If it is complete, the request is
+    conditional and nothing is downloaded when the server answers 304 Not
+    Modified. If it is partial, the download resumes from the end of the
+    .part file, provided the file is still the one the part was taken from
+    (If-Range); otherwise the server sends it whole and it starts over.
+    started(validators) is called with the ETag and Last-Modified of the
+    response before its body is read, so that an interrupted download can
+    be resumed.
+
+    Returns (validators, number of bytes received), or None if not modified.
+    """
+    part_path = path + ".part"
+    headers = {}
+    offset = 0
+    if entry.get("complete"):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    elif os.path.exists(part_path) and if_range_validator(entry):
+        offset = os.path.getsize(part_path)
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = if_range_validator(entry)
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304:
+            return None
+        if response.status_code == 416:
+            # the part is already the whole file, or the file shrank:
+            # start over either way
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise IncompleteDownload("Requested range not satisfiable")
+        response.raise_for_status()
+
+        if response.status_code != 206:
+            offset = 0
+        elif not response.headers.get("Content-Range", "").startswith(
+            f"bytes {offset}-"
+        ):
+            raise IncompleteDownload("Unexpected Content-Range")
+
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        started(validators)
+
+        expected = response.headers.get("Content-Length")
+        received = 0
+        with open(part_path, "ab" if offset else "wb") as part_file:
+            for chunk in response.iter_content(chunk_size):
+                part_file.write(chunk)
+                received += len(chunk)
+
+    if expected is not None and received != int(expected):
+        raise IncompleteDownload(f"Received {received} of {expected} bytes")
+
+    os.replace(part_path, path)
+    return validators, received
+
+
+def download_pdfs(
+    links,
+    save_directory,
+    pdf_base_url=pdf_base_url,
+    workers=8,
+    retries=3,
+    refresh=False,
+    session=None,
+):
+    """
+    Downloads the PDF of every link into save_directory, workers at a time
+    over one pooled session.
+
+    A manifest in save_directory records where every PDF came from and its
+    validators (ETag, Last-Modified). PDFs that are complete on disk are
+    skipped without a request, or revalidated with a conditional request if
+    refresh is set. Interrupted downloads are kept as .part files and resume
+    where they stopped, in the same run (up to retries times) or the next.
+
+    Returns {"downloaded", "up_to_date", "failed", "bytes", "seconds"}.
+    """
+    os.makedirs(save_directory, exist_ok=True)
+    session = session or make_session(workers)
+    manifest = Manifest(save_directory)
+    lock = threading.Lock()
+
+    # several posts can point to the same issue
+    urls = {pdf_filename(link): pdf_base_url + pdf_filename(link) for link in links}
+
+    def record(filename, fingerprint, **outputs):
+        with lock:
+            manifest.record(filename, fingerprint, **outputs)
+            # save as we go so that an interrupted run can resume
+            manifest.save()
+
+    def is_complete(filename, entry):
+        path = os.path.join(save_directory, filename)
+        return (
+            entry.get("complete")
+            and os.path.exists(path)
+            and os.path.getsize(path) == entry["size"]
+        )
+
+    def download(filename, url):
+        # number of bytes received, None if the PDF was not modified
+        path = os.path.join(save_directory, filename)
+        entry = manifest.entries.get(filename, {})
+        if entry.get("url") != url or (
+            entry.get("complete") and not is_complete(filename, entry)
+        ):
+            entry = {}
+
+        for attempt in range(retries + 1):
+            try:
+                result = fetch(
+                    session,
+                    url,
+                    path,
+                    entry,
+                    lambda validators: record(
+                        filename, {}, url=url, complete=False, **validators
+                    ),
+                )
+                break
+            except RETRIABLE_ERRORS:
+                if attempt == retries:
+                    raise
+            except requests.HTTPError as e:
+                if e.response.status_code < 500 or attempt == retries:
+                    raise
+            # try again straight away, resuming from what was received
+            entry = manifest.entries.get(filename, {})
+        if result is None:
+            return None
+
+        validators, received = result
+        stat = os.stat(path)
+        record(
+            filename,
+            {
+                "hash": file_hash(path),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            },
+            url=url,
+            complete=True,
+            **validators,
+        )
+        return received
+
+    summary = {"downloaded": 0, "up_to_date": 0, "failed": {}, "bytes": 0}
+    start = time.perf_counter()
+
+    pending = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for filename, url in urls.items():
+            entry = manifest.entries.get(filename, {})
+            if not refresh and entry.get("url") == url and is_complete(filename, entry):
+                summary["up_to_date"] += 1
+                continue
+            pending[pool.submit(download, filename, url)] = filename
+
+        for future in as_completed(pending):
+            filename = pending[future]
+            try:
+                received = future.result()
+            except (requests.RequestException, IncompleteDownload) as e:
+                summary["failed"][filename] = str(e)
+                print(f"Failed: {filename}: {e}")
+                continue
+
+            if received is not None:
+                summary["downloaded"] += 1
+                summary["bytes"] += received
+                print(f"Downloaded: {filename}")
+            else:
+                summary["up_to_date"] += 1
+
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+if __name__ == "__main__":
+    # usage: python build_tig_corpus.py [workers] [--refresh]
+    refresh = "--refresh" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--refresh"]
+    workers = int(args[0]) if args else 8
+
+    links = load_links(links_file)
+    summary = download_pdfs(links, save_directory, workers=workers, refresh=refresh)
+
+    print(
+        f"{summary['downloaded']} PDFs downloaded, {summary['up_to_date']} up to date, "
+        f"{len(summary['failed'])} failed: {summary['bytes'] / 2**20:.1f} MB in "
+        f"{summary['seconds']:.1f}s "
+        f"({summary['bytes'] / 2**20 / max(summary['seconds'], 1e-9):.1f} MB/s)"
+    )
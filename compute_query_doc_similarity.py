@@ -1,70 +1,70 @@
-import pandas as pd
-import numpy as np
 from collections import Counter
 import json
-from datetime import datetime
 
+from backend.helper_functions import convert_date
+from backend.query_cache import QueryCache, query_key
+from backend.scoring import cosine_scores, top_k_documents
+from backend.sparse_index import SparseIndex
 
-def convert_date(date_str):
-    # Parse the input date string using the format DDMMYYYY
-    date_obj = datetime.strptime(date_str, "%d%m%Y")
-    # Convert it to the desired format: Month, DD, YYYY
-    formatted_date = date_obj.strftime("%B %d, %Y")
-    return formatted_date
 
+INDEX_DIR = "tig_index"
+_index = None
+# results of recent queries, see QueryCache
+cache = QueryCache()
 
-def cosine_similarity(vec1, vec2):
-    dot_product = np.dot(vec1, vec2)
-    magnitude1 = np.sqrt(np.dot(vec1, vec1))
-    magnitude2 = np.sqrt(np.dot(vec2, vec2))
-    if magnitude1 == 0 or magnitude2 == 0:
-        return 0
-    return dot_product / (magnitude1 * magnitude2)
 
+def load_index(index_dir=INDEX_DIR):
+    # The index is memory-mapped once per process and reused by every query,
+    # until it is rebuilt
+    global _index
+    if _index is None or _index.index_dir != index_dir or _index.is_stale():
+        _index = SparseIndex(index_dir)
+    return _index
 
-def retrieve_docs(query_tokens):
-    # Step 1: Load the Term-Document Matrix
-    term_doc_matrix = pd.read_csv("term_document_matrix.csv", index_col=0)
-
-    # Step 2: Extract Vocabulary and Initialize Query Vector
-    vocabulary = term_doc_matrix.index.tolist()
-    query_vector = np.zeros(len(vocabulary))
 
-    # Step 3: Calculate TF-IDF for Query Terms
+def retrieve_docs(query_tokens):
+    # Step 1: Open the Term-Document Index
+    index = load_index()
+
+    # Repeated queries are answered from the cache; keys include the index
+    # version, so a rebuilt index never serves the old results
+    key = query_key(index.version, query_tokens, 10)
+    doc_locations_json = cache.get(key)
+    if doc_locations_json is None:
+        doc_locations_json = rank_docs(index, query_tokens)
+        cache.put(key, doc_locations_json)
+    return doc_locations_json
+
+
+def rank_docs(index, query_tokens):
+    # Step 2: Calculate TF-IDF for Query Terms
+    # term ids come from a hash map and IDFs were computed at index build time
+    # (backend.scoring.log_idf)
     query_term_freq = Counter(query_tokens)
-    N = len(term_doc_matrix.columns)  # Number of documents
+    query_vector = {}
 
     for term, freq in query_term_freq.items():
-        if term in vocabulary:
-            term_index = vocabulary.index(term)
-            df = (term_doc_matrix.loc[term] > 0).sum()  # Document frequency of the term
-            idf = np.log(N / (1 + df))  # Compute IDF
-            query_vector[term_index] = freq * idf  # TF-IDF for the term in the query
-
-    # Transpose the matrix so that each row represents a document vector
-    doc_vectors = term_doc_matrix.values.T
-
-    # Step 4: Compute Cosine Similarity
-    # Calculate cosine similarity between the query vector and each document vector
-    cosine_similarities = []
-    for doc_id, doc_vector in enumerate(doc_vectors):
-        similarity = cosine_similarity(query_vector, doc_vector)
-        cosine_similarities.append((doc_id, similarity))
-
-    # Sort the documents by similarity score in descending order
-    ranked_docs = sorted(cosine_similarities, key=lambda x: x[1], reverse=True)
-
-    # Step 5: Compute document locations for the top 10 ranked documents
-    top_docs = ranked_docs[:10]
+        term_index = index.term_id(term)
+        if term_index is not None:
+            query_vector[term_index] = freq * index.idf[term_index]
+
+    # Step 3: Compute Cosine Similarity
+    # one sparse matrix-vector product over the postings of the query terms,
+    # normalised with the page norms stored in the index
+    page_ids, similarities = cosine_scores(index, query_vector)
+
+    # Step 4: Compute document locations for the top 10 ranked documents,
+    # each scored as (and linking to) its best page
+    _, top_page_ids, _ = top_k_documents(
+        page_ids, similarities, index.page_documents, 10
+    )
     doc_locations = []
-    for doc_id, score in top_docs:
-        # Assuming doc_id is in the format 01022023 (date)
-        doc_id_str = str(doc_id).zfill(8)  # Ensure doc_id is 8 digits
-        document_location = f"tig_corpus (pdf)/haddas_eritra_{doc_id_str}.pdf"
+    for page_id in top_page_ids:
+        document = index.documents[page_id]
         doc_locations.append(
             {
-                "doc_title": f"{convert_date(doc_id)} - Haddas Eritrea",
-                "doc_location": document_location,
+                "doc_title": f"{convert_date(document['document_id'])} - Haddas Eritrea",
+                "doc_location": f"{document['document_location']}#page={document['page']}",
             }
         )
 
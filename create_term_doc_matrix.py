@@ -1,83 +1,77 @@
 import os
+import sys
 import json
-import math
-import csv
-from collections import defaultdict, Counter
-
-
-def compute_tf(tokens):
-    term_count = Counter(tokens)
-    total_terms = len(tokens)
-    tf = {term: count / total_terms for term, count in term_count.items()}
-    return tf
-
-
-def compute_idf(documents):
-    N = len(documents)
-    idf = defaultdict(lambda: 0)
-
-    for tokens in documents.values():
-        unique_terms = set(tokens)
-        for term in unique_terms:
-            idf[term] += 1
-
-    idf = {term: math.log(N / count) for term, count in idf.items()}
-    return idf
-
-
-def compute_tf_idf(tf, idf):
-    tf_idf = {term: tf_val * idf[term] for term, tf_val in tf.items()}
-    return tf_idf
-
-
-def build_tf_idf_matrix(folder_path):
-    documents = {}
-    tf_matrix = {}
-
-    # Read documents and compute TF for each
-    for filename in os.listdir(folder_path):
-        if filename.endswith(".json"):
-            file_path = os.path.join(folder_path, filename)
-            with open(file_path, "r", encoding="utf-8") as file:
-                data = json.load(file)
-                document_id = data["document_id"]
-                tokens = data["tokens"]
-                documents[document_id] = tokens
-                tf_matrix[document_id] = compute_tf(tokens)
-
-    # Compute IDF for all terms
-    idf = compute_idf(documents)
-
-    # Compute TF-IDF matrix
-    tf_idf_matrix = {}
-    for document_id, tf in tf_matrix.items():
-        tf_idf_matrix[document_id] = compute_tf_idf(tf, idf)
-
-    return tf_idf_matrix, sorted(idf.keys())
-
-
-def save_tf_idf_matrix(tf_idf_matrix, terms, output_file):
-    with open(output_file, "w", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file)
-
-        # Write header
-        header = ["Document ID"] + terms
-        writer.writerow(header)
-
-        # Write TF-IDF rows
-        for document_id, tf_idf in tf_idf_matrix.items():
-            row = [document_id] + [tf_idf.get(term, 0.0) for term in terms]
-            writer.writerow(row)
+from collections import Counter
+
+from backend.helper_functions import document_pages
+from backend.manifest import Manifest
+from backend.sparse_index import META_FILE, SparseIndex, update_sparse_index
+
+
+def update_tf_idf_index(folder_path, output_dir, full=False):
+    """
+    Brings the index in output_dir up to date with the JSON documents of
+    folder_path. Only documents that are new or changed since the last run
+    (according to the manifest kept in output_dir) are read; the counts of the
+    others are taken from the index. Builds the index from scratch if there is
+    none yet or full is set.
+    Returns (number of documents read, number of documents removed).
+    """
+    manifest = Manifest(output_dir)
+    index = None
+    if full or not os.path.exists(os.path.join(output_dir, META_FILE)):
+        manifest.entries = {}
+    else:
+        index = SparseIndex(output_dir)
+
+    file_names = sorted(
+        filename for filename in os.listdir(folder_path) if filename.endswith(".json")
+    )
+    changed, removed, fingerprints = manifest.changes(folder_path, file_names)
+    if index is not None and not changed and not removed:
+        return 0, 0
+
+    # the previous versions of changed documents are replaced
+    removed_document_ids = [
+        manifest.entries[filename]["document_id"]
+        for filename in changed + removed
+        if filename in manifest.entries
+    ]
+
+    term_counts = {}
+    document_locations = {}
+    for filename in changed:
+        file_path = os.path.join(folder_path, filename)
+        with open(file_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+            document_id = data["document_id"]
+            for page, tokens in document_pages(data):
+                term_counts[document_id, page] = Counter(tokens)
+            document_locations[document_id] = data["document_location"]
+        manifest.record(filename, fingerprints[filename], document_id=document_id)
+
+    update_sparse_index(
+        index, removed_document_ids, term_counts, document_locations, output_dir
+    )
+
+    for filename in removed:
+        manifest.forget(filename)
+    manifest.save()
+
+    return len(changed), len(removed)
 
 
 if __name__ == "__main__":
     folder_path = "tig_corpus (json)"
-    output_file = "tf_idf_matrix.csv"
-
-    # Build the TF-IDF matrix
-    tf_idf_matrix, terms = build_tf_idf_matrix(folder_path)
-
-    # Save the TF-IDF matrix to a CSV file
-    save_tf_idf_matrix(tf_idf_matrix, terms, output_file)
-
-    print(f"TF-IDF matrix saved to {output_file}")
+    output_dir = "tig_index"
+
+    # Update the memory-mappable sparse index with the new and changed
+    # documents, or build it (python create_term_doc_matrix.py --full)
+    num_read, num_removed = update_tf_idf_index(
+        folder_path, output_dir, full="--full" in sys.argv
+    )
+
+    print(
+        f"TF-IDF index saved to {output_dir} "
+        f"({num_read} documents read, {num_removed} removed)"
+    )
@@ -1,55 +1,314 @@
 import os
+import sys
+import time
 import logging
-from pdfminer.high_level import extract_text
+import resource
+import multiprocessing
+from multiprocessing.connection import wait
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTContainer, LTText, LTTextBox
 from pdfminer.pdftypes import PDFException
 
+from backend.manifest import Manifest
+
 # Configure logging
 logging.basicConfig(
-    filename='pdf_conversion.log',
+    filename="pdf_conversion.log",
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
 )
 
-def convert_pdfs_to_txt(input_folder, output_folder):
+
+def page_text(page):
+    """
+    Text of one pdfminer LTPage, rendered like pdfminer's extract_text does
+    (TextConverter), without the page's closing form feed.
+    """
+    parts = []
+
+    def render(item):
+        if isinstance(item, LTContainer):
+            for child in item:
+                render(child)
+        elif isinstance(item, LTText):
+            parts.append(item.get_text())
+        if isinstance(item, LTTextBox):
+            parts.append("\n")
+
+    render(page)
+    return "".join(parts)
+
+
+def extract_worker(pdf_path, txt_path, memory_limit_mb, conn):
+    """
+    Runs in its own process: extracts the text of one PDF into txt_path and
+    sends back ("ok", number of pages) or ("error", message).
+
+    Pages are laid out and written one at a time, each followed by a form
+    feed (as extract_text does), so memory is bounded by the largest page
+    rather than the whole issue, and later stages can tell the pages apart.
+    """
+    if memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    try:
+        # Write the extracted text to a txt file, renamed into place once
+        # complete so that a killed worker never leaves half a file behind
+        num_pages = 0
+        with open(
+            txt_path + ".tmp", "w", encoding="utf-8", errors="ignore"
+        ) as txt_file:
+            # Extract text from the PDF, page by page
+            for page in extract_pages(pdf_path):
+                txt_file.write(page_text(page) + "\f")
+                num_pages += 1
+        os.replace(txt_path + ".tmp", txt_path)
+
+        conn.send(("ok", num_pages))
+    except PDFException as e:
+        conn.send(("error", f"Failed to convert: {e}"))
+    except MemoryError:
+        conn.send(("error", f"Ran out of memory (limit {memory_limit_mb} MB)"))
+    except Exception as e:
+        conn.send(("error", f"An unexpected error occurred: {e}"))
+    finally:
+        conn.close()
+
+
+class Job:
+    def __init__(self, filename, attempt=1):
+        self.filename = filename
+        self.attempt = attempt
+        self.process = None
+        self.conn = None
+        self.start = None
+
+
+def convert_pdfs_to_txt(
+    input_folder,
+    output_folder,
+    full=False,
+    workers=None,
+    timeout=120,
+    memory_limit_mb=2048,
+    retries=1,
+    retry_quarantined=False,
+    num_slowest=5,
+):
+    """
+    Extracts the text of the PDFs of input_folder into output_folder.
+
+    Only PDFs that are new or changed since the last run (according to the
+    manifest kept in output_folder) are converted, unless full is set.
+    The text files of PDFs that were removed are removed as well.
+
+    Every PDF is extracted in a process of its own, at most workers
+    (os.cpu_count() by default) at a time, so that a pathological PDF can
+    only take its own process down: it is killed after timeout seconds, and
+    cannot allocate more than memory_limit_mb. A failed PDF is retried up to
+    retries times, then quarantined: it is skipped by later runs until its
+    content changes or retry_quarantined is set.
+
+    The manifest is saved after every PDF, so an interrupted run resumes
+    where it stopped. Returns the summary report (see report).
+    """
     # Create the output folder if it doesn't exist
     os.makedirs(output_folder, exist_ok=True)
-    
-    # Loop through all the files in the input folder
-    for filename in os.listdir(input_folder):
-        if filename.endswith(".pdf"):
-            pdf_path = os.path.join(input_folder, filename)
-            
-            try:
-                # Extract text from the PDF
-                text = extract_text(pdf_path)
-                
-                # Create a corresponding txt file name
-                txt_filename = f"{os.path.splitext(filename)[0]}.txt"
-                txt_path = os.path.join(output_folder, txt_filename)
-                
-                # Write the extracted text to a txt file
-                with open(txt_path, 'w', encoding='utf-8') as txt_file:
-                    txt_file.write(text)
-                
-                # Log and print progress
-                log_msg = f"Converted: {filename} -> {txt_filename}"
-                logging.info(log_msg)
-                print(log_msg)
-
-            except PDFException as e:
-                # Log and print errors related to PDF processing
-                error_msg = f"Failed to convert {filename}: {e}"
-                logging.error(error_msg)
-                print(error_msg)
-            except Exception as e:
-                # Log and print any other unforeseen errors
-                unexpected_error_msg = f"An unexpected error occurred with {filename}: {e}"
-                logging.error(unexpected_error_msg)
-                print(unexpected_error_msg)
+    workers = workers or os.cpu_count()
+
+    manifest = Manifest(output_folder)
+    if full:
+        manifest.entries = {}
+    if retry_quarantined:
+        for filename, entry in list(manifest.entries.items()):
+            if entry.get("quarantined"):
+                manifest.forget(filename)
+
+    filenames = [
+        filename
+        for filename in sorted(os.listdir(input_folder))
+        if filename.endswith(".pdf")
+    ]
+    # a PDF is redone when it is new, changed, or its text file was deleted
+    output_exists = lambda filename, entry: entry.get("quarantined") or (
+        os.path.exists(os.path.join(output_folder, entry["output"]))
+    )
+    changed, removed, fingerprints = manifest.changes(
+        input_folder, filenames, output_exists
+    )
+
+    for filename in removed:
+        txt_filename = manifest.forget(filename).get("output")
+        if txt_filename and os.path.exists(os.path.join(output_folder, txt_filename)):
+            os.remove(os.path.join(output_folder, txt_filename))
+            logging.info(f"Removed: {txt_filename} (its PDF is gone)")
+    manifest.save()
+
+    print(f"{len(changed)} of {len(filenames)} PDFs are new or changed")
+
+    queue = [Job(filename) for filename in changed]
+    queue.reverse()  # pop() from the end, in file name order
+    running = []
+    converted, failed = {}, {}
+    start = time.perf_counter()
+
+    def launch(job):
+        # Create a corresponding txt file name
+        txt_filename = f"{os.path.splitext(job.filename)[0]}.txt"
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        job.conn = receiver
+        job.process = multiprocessing.Process(
+            target=extract_worker,
+            args=(
+                os.path.join(input_folder, job.filename),
+                os.path.join(output_folder, txt_filename),
+                memory_limit_mb,
+                sender,
+            ),
+            daemon=True,
+        )
+        job.start = time.perf_counter()
+        job.process.start()
+        sender.close()
+        running.append(job)
+
+    def finish(job, status, result):
+        running.remove(job)
+        job.process.join()
+        job.conn.close()
+        seconds = time.perf_counter() - job.start
+        txt_filename = f"{os.path.splitext(job.filename)[0]}.txt"
+        # left behind by a worker that was killed while writing
+        temp_path = os.path.join(output_folder, txt_filename + ".tmp")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        if status == "ok":
+            converted[job.filename] = (result, seconds)
+            manifest.record(
+                job.filename,
+                fingerprints[job.filename],
+                output=txt_filename,
+                pages=result,
+                seconds=round(seconds, 3),
+            )
+            # Log and print progress
+            log_msg = (
+                f"Converted: {job.filename} -> {txt_filename} "
+                f"({result} pages, {seconds:.1f}s)"
+            )
+            logging.info(log_msg)
+            print(log_msg)
+        elif job.attempt <= retries:
+            logging.warning(f"{job.filename}: {result}, retrying")
+            queue.append(Job(job.filename, job.attempt + 1))
+            return
+        else:
+            failed[job.filename] = result
+            manifest.record(
+                job.filename,
+                fingerprints[job.filename],
+                output=None,
+                quarantined=result,
+            )
+            error_msg = (
+                f"Quarantined {job.filename} after {job.attempt} attempts: {result}"
+            )
+            logging.error(error_msg)
+            print(error_msg)
+
+        # save as we go so that an interrupted run can resume
+        manifest.save()
+
+    try:
+        while queue or running:
+            while queue and len(running) < workers:
+                launch(queue.pop())
+
+            # wake up when a worker reports or exits, or at the next deadline
+            next_deadline = min(job.start + timeout for job in running)
+            ready = wait(
+                [job.conn for job in running]
+                + [job.process.sentinel for job in running],
+                timeout=max(0, next_deadline - time.perf_counter()),
+            )
+
+            for job in list(running):
+                exited = job.process.sentinel in ready or not job.process.is_alive()
+                # a worker can report and exit after wait() returned, its
+                # result then still waits in the pipe
+                if job.conn in ready or (exited and job.conn.poll()):
+                    try:
+                        status, result = job.conn.recv()
+                    except EOFError:
+                        # exited without a word: killed by the kernel or crashed
+                        job.process.join()
+                        status = "error"
+                        result = f"Worker exited with code {job.process.exitcode}"
+                    finish(job, status, result)
+                elif exited:
+                    job.process.join()
+                    finish(
+                        job, "error", f"Worker exited with code {job.process.exitcode}"
+                    )
+                elif time.perf_counter() - job.start > timeout:
+                    job.process.kill()
+                    finish(job, "error", f"Timed out after {timeout}s")
+    finally:
+        for job in running:
+            job.process.kill()
+            job.process.join()
+        manifest.save()
+
+    return report(converted, failed, time.perf_counter() - start, num_slowest)
+
+
+def report(converted, failed, seconds, num_slowest=5):
+    """
+    converted: {filename: (pages, seconds)}, failed: {filename: error}
+    Logs and prints the summary of a run, and returns it as a dict.
+    """
+    pages = sum(num_pages for num_pages, _ in converted.values())
+    slowest = sorted(converted.items(), key=lambda item: -item[1][1])[:num_slowest]
+    summary = {
+        "converted": len(converted),
+        "failed": len(failed),
+        "pages": pages,
+        "seconds": seconds,
+        "pages_per_second": pages / seconds if seconds else 0.0,
+        "slowest": [
+            {"filename": filename, "pages": num_pages, "seconds": doc_seconds}
+            for filename, (num_pages, doc_seconds) in slowest
+        ],
+        "quarantined": failed,
+    }
+
+    lines = [
+        f"{len(converted)} PDFs converted, {len(failed)} quarantined, "
+        f"{pages} pages in {seconds:.1f}s ({summary['pages_per_second']:.1f} pages/sec)"
+    ]
+    if slowest:
+        lines.append("Slowest documents:")
+        lines.extend(
+            f"  {filename}: {doc_seconds:.1f}s, {num_pages} pages"
+            for filename, (num_pages, doc_seconds) in slowest
+        )
+    for line in lines:
+        logging.info(line)
+        print(line)
+
+    return summary
+
 
 if __name__ == "__main__":
     input_folder = "tig_corpus (pdf)"
     output_folder = "tig_corpus (txt)"
-    
-    convert_pdfs_to_txt(input_folder, output_folder)
+
+    convert_pdfs_to_txt(
+        input_folder,
+        output_folder,
+        full="--full" in sys.argv,
+        retry_quarantined="--retry-quarantined" in sys.argv,
+    )
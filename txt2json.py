@@ -1,7 +1,13 @@
-from backend.preprocessing import TigMorphPreprocess
+from backend.preprocessing import preprocess_file_pages, preprocess_text_pages
+from backend.manifest import Manifest
+from backend.resources import get_resources
+from concurrent.futures import ProcessPoolExecutor
 import os
+import sys
 import json
 import logging
+import time
+from functools import partial
 from pathlib import Path
 
 # Set up logging
@@ -16,8 +22,9 @@ source_folder = "tig_corpus (txt)"
 target_folder = "tig_corpus (json)"
 documents_folder = "tig_corpus (pdf)"
 
-# Ensure target folder exists
-os.makedirs(target_folder, exist_ok=True)
+# Text files up to this size (in bytes) are preprocessed as one string, larger
+# ones are streamed page by page so their text is never held in memory
+stream_threshold = 2**25
 
 
 # Function to extract document_id from file name
@@ -27,40 +34,189 @@ def extract_document_id(file_name):
     return parts[-1]  # Return the last part as the document_id
 
 
-# Process each file in the source folder
-for file_name in os.listdir(source_folder):
-    if file_name.endswith(".txt"):
-        # Construct full file path
-        file_path = os.path.join(source_folder, file_name)
+def dump_json_list(name, values, json_file):
+    """
+    Writes the "name": [values] member of a JSON object indented like
+    json.dump(..., indent=4), one value at a time. Returns the number of values.
+    """
+    json_file.write(f',\n    "{name}": [')
 
-        # Load the text file
+    count = 0
+    for value in values:
+        separator = ",\n" if count else "\n"
+        json_file.write(separator + " " * 8 + json.dumps(value, ensure_ascii=False))
+        count += 1
+
+    json_file.write("\n    ]" if count else "]")
+    return count
+
+
+def dump_json_document(json_data, page_tokens, json_file):
+    """
+    Same output as json.dump(json_data, json_file, ensure_ascii=False, indent=4)
+    with json_data["tokens"] the tokens of page_tokens ((page number, token)
+    pairs) and json_data["page_lengths"] the number of tokens of every page,
+    but the tokens are written as they are produced instead of being
+    collected first.
+    Returns the number of tokens written.
+    """
+    page_lengths = []
+
+    def tokens():
+        for page, token in page_tokens:
+            page_lengths.extend([0] * (page - len(page_lengths)))
+            page_lengths[page - 1] += 1
+            yield token
+
+    # drop the closing "\n}" to append the tokens
+    json_file.write(json.dumps(json_data, ensure_ascii=False, indent=4)[:-2])
+    num_tokens = dump_json_list("tokens", tokens(), json_file)
+    dump_json_list("page_lengths", page_lengths, json_file)
+    json_file.write("\n}")
+    return num_tokens
+
+
+def init_worker():
+    # load the stopwords, affix lists and stemmer once per worker process,
+    # before its first document
+    get_resources()
+
+
+def convert_txt_to_json(file_name, source_folder, target_folder, documents_folder):
+    """
+    Preprocesses one text file into its JSON document.
+    Returns (name of the JSON file, number of tokens).
+    """
+    # Construct full file path
+    file_path = os.path.join(source_folder, file_name)
+
+    # Preprocess the text, streaming it from the file page by page if it is large
+    if os.path.getsize(file_path) > stream_threshold:
+        page_tokens = preprocess_file_pages(file_path)
+    else:
         with open(file_path, "r", encoding="utf-8") as file:
-            text = file.read().replace("\n", " ")
+            page_tokens = preprocess_text_pages(file.read())
+
+    # Prepare JSON data
+    document_id = extract_document_id(file_name)
+    document_location = os.path.join(
+        documents_folder, file_name.replace(".txt", ".pdf")
+    )
 
-        # Preprocess the text
-        psr = TigMorphPreprocess(text)
-        psr.tokenize().normalize().remove_stopwords().stem()
-        tokens = psr.get_result()
+    json_data = {
+        "document_id": document_id,
+        "document_location": document_location,
+    }
 
-        # Prepare JSON data
-        document_id = extract_document_id(file_name)
-        document_location = os.path.join(
-            documents_folder, file_name.replace(".txt", ".pdf")
+    # Save JSON data
+    json_file_name = file_name.replace(".txt", ".json")
+    json_file_path = os.path.join(target_folder, json_file_name)
+
+    # written as the tokens are produced, so renamed into place once complete
+    # to never leave half a JSON file behind
+    temp_path = json_file_path + ".tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as json_file:
+            num_tokens = dump_json_document(json_data, page_tokens, json_file)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, json_file_path)
+
+    return json_file_name, num_tokens
+
+
+def convert_folder(
+    source_folder,
+    target_folder,
+    documents_folder,
+    workers=None,
+    chunksize=4,
+    full=False,
+):
+    """
+    Preprocesses the text files of source_folder into target_folder.
+    Only files that are new or changed since the last run (according to the
+    manifest kept in target_folder) are preprocessed, unless full is set, and
+    the JSON files of removed text files are removed.
+    Documents are independent, so they are spread over a pool of workers
+    processes (os.cpu_count() by default), handed out chunksize at a time.
+    Returns (number of documents preprocessed, number of tokens, seconds).
+    """
+    # Ensure target folder exists
+    os.makedirs(target_folder, exist_ok=True)
+
+    manifest = Manifest(target_folder)
+    if full:
+        manifest.entries = {}
+
+    all_file_names = sorted(
+        file_name
+        for file_name in os.listdir(source_folder)
+        if file_name.endswith(".txt")
+    )
+    file_names, removed, fingerprints = manifest.changes(
+        source_folder,
+        all_file_names,
+        lambda file_name, entry: os.path.exists(
+            os.path.join(target_folder, entry["output"])
+        ),
+    )
+
+    for file_name in removed:
+        json_file_path = os.path.join(
+            target_folder, manifest.forget(file_name)["output"]
         )
+        if os.path.exists(json_file_path):
+            os.remove(json_file_path)
+        logging.info(f"Removed: {json_file_path} (its text file is gone)")
+
+    logging.info(f"{len(file_names)} of {len(all_file_names)} files are new or changed")
+
+    convert = partial(
+        convert_txt_to_json,
+        source_folder=source_folder,
+        target_folder=target_folder,
+        documents_folder=documents_folder,
+    )
+
+    start = time.perf_counter()
+    total_tokens = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            results = pool.map(convert, file_names, chunksize=chunksize)
+            for file_name, (json_file_name, num_tokens) in zip(file_names, results):
+                total_tokens += num_tokens
+                manifest.record(
+                    file_name, fingerprints[file_name], output=json_file_name
+                )
+                logging.info(
+                    f"Processed and saved file: {file_name} as {json_file_name}"
+                )
+    finally:
+        # keep what was done even if a document failed
+        manifest.save()
 
-        json_data = {
-            "document_id": document_id,
-            "document_location": document_location,
-            "tokens": tokens,
-        }
+    return len(file_names), total_tokens, time.perf_counter() - start
 
-        # Save JSON data
-        json_file_name = file_name.replace(".txt", ".json")
-        json_file_path = os.path.join(target_folder, json_file_name)
 
-        with open(json_file_path, "w", encoding="utf-8") as json_file:
-            json.dump(json_data, json_file, ensure_ascii=False, indent=4)
+if __name__ == "__main__":
+    # usage: python txt2json.py [workers] [chunksize] [--full]
+    full = "--full" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--full"]
+    workers = int(args[0]) if len(args) > 0 else os.cpu_count()
+    chunksize = int(args[1]) if len(args) > 1 else 4
 
-        logging.info(f"Processed and saved file: {file_name} as {json_file_name}")
+    num_docs, num_tokens, seconds = convert_folder(
+        source_folder, target_folder, documents_folder, workers, chunksize, full
+    )
 
-print("Preprocessing and saving completed.")
+    print("Preprocessing and saving completed.")
+    print(
+        f"{num_docs} documents, {num_tokens} tokens in {seconds:.2f}s with "
+        f"{workers} workers: {num_docs / seconds:.1f} docs/sec, "
+        f"{num_tokens / seconds:.0f} tokens/sec"
+        if num_docs
+        else "Every document is up to date"
+    )